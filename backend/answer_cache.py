@@ -0,0 +1,118 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from backend.lexical import tokenize
+from backend.tracing import count
+
+# Cosine similarity above which two questions get the same answer
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("PERSONALAI_ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = float(os.environ.get("PERSONALAI_ANSWER_CACHE_TTL", 24 * 3600))
+ANSWER_CACHE_SIZE = int(os.environ.get("PERSONALAI_ANSWER_CACHE_SIZE", 10_000))
+
+
+class SemanticAnswerCache:
+    """
+    Answers keyed by (store id, question embedding), shared by every session.
+    A question about the same store whose embedding is within threshold of a
+    cached question's, and that names the same numbers and ids, gets the
+    cached answer, so rephrasings hit as well.
+    Least recently used answers are evicted past max_entries, and answers
+    older than ttl seconds are never returned.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        # entry id -> (store id, answer, created, numbered tokens), in least recently used order
+        self._entries = OrderedDict()
+        # store id -> (entry ids, unit question vectors), searched together
+        self._stores = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, entry_id: int):
+        store_id = self._entries.pop(entry_id)[0]
+        ids, vectors = self._stores[store_id]
+        row = ids.index(entry_id)
+        del ids[row]
+        if ids:
+            self._stores[store_id] = (ids, np.delete(vectors, row, axis=0))
+        else:
+            del self._stores[store_id]
+
+    def get(self, store_id: str, question: str, vector: list):
+        answer = None
+        now = time.time()
+        numbered = _numbered_tokens(question)
+        with self._lock:
+            ids, _ = self._stores.get(store_id, ([], None))
+            for entry_id in [i for i in ids if now - self._entries[i][2] > self.ttl]:
+                self._remove(entry_id)
+
+            ids, vectors = self._stores.get(store_id, ([], None))
+            if ids and vectors.shape[1] == len(vector):
+                similarities = vectors @ _unit(vector)
+                # "PN-00012" and "PN-00013" embed alike but are different questions
+                for row, entry_id in enumerate(ids):
+                    if self._entries[entry_id][3] != numbered:
+                        similarities[row] = -np.inf
+                row = int(np.argmax(similarities))
+                if similarities[row] >= self.threshold:
+                    self._entries.move_to_end(ids[row])
+                    answer = self._entries[ids[row]][1]
+
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        count("answer_cache_hits" if answer is not None else "answer_cache_misses")
+        return answer
+
+    def set(self, store_id: str, question: str, vector: list, answer: str):
+        with self._lock:
+            ids, vectors = self._stores.get(store_id, ([], None))
+            if ids and vectors.shape[1] != len(vector):
+                return
+
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (store_id, answer, time.time(), _numbered_tokens(question))
+            row = _unit(vector)[None, :]
+            self._stores[store_id] = (ids + [entry_id], row if not ids else np.vstack([vectors, row]))
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses}
+
+
+def _numbered_tokens(question: str) -> frozenset:
+    return frozenset(token for token in tokenize(question) if any(char.isdigit() for char in token))
+
+
+def _unit(vector: list) -> np.ndarray:
+    vector = np.asarray(vector, dtype="float32")
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+_cache = None
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    global _cache
+    if _cache is None:
+        _cache = SemanticAnswerCache()
+    return _cache
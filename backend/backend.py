@@ -1,95 +1,160 @@
-import pdfplumber
+import os
+import threading
+from collections import OrderedDict
+
 import streamlit as st
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, WebBaseLoader
-from langchain_community.vectorstores import Chroma, FAISS
-from langchain_core.output_parsers import StrOutputParser
+from langchain_community.vectorstores import FAISS
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_core.runnables import RunnableBranch, RunnableLambda
 
 from langchain.chains import (create_history_aware_retriever,
                               create_retrieval_chain)
 from langchain.text_splitter import CharacterTextSplitter, RecursiveCharacterTextSplitter
 from langchain.chains.combine_documents import create_stuff_documents_chain;
 
+from backend.answer_cache import get_answer_cache
+from backend.context import assemble_context
+from backend.corpus import Corpus
+from backend.embedding_cache import CachedEmbeddings, get_embedding_cache
+from backend.embeddings import EMBEDDING_ENGINE, load_embedding_engine
+from backend.extraction import iter_chunks, iter_pdf_pages
+from backend.history import HistoryWindow, needs_query_rewrite
+from backend.index_store import get_file_hash, get_index_key, load_vectorstore, save_vectorstore
+from backend.lazy import lazy_module
+from backend.lexical import attach_lexical_index, get_retriever
+from backend.llm_cache import get_cache_key, get_llm_cache
+from backend.registry import get_llm, get_openai_embeddings, get_store_chain, run_async
+from backend.scheduler import get_embedding_scheduler
+from backend.tracing import traced
+from backend.vector_index import INDEX_MODE, compress_vectorstore
+from backend.translation import (LAYOUT_FORMATTING, SEGMENT_MAX_CHARS, get_format_chain,
+                                 get_translation_chain, split_segments, translate_segments)
+
+# Chunking used for the chatbot index, part of the on-disk index key
+PDF_CHUNK_PARAMS = {"separator": "\n", "chunk_size": 1000, "chunk_overlap": 200}
+
+# Chunks embedded per request while a PDF is still being parsed
+EMBEDDING_BATCH_SIZE = 64
+
+# httpx and BeautifulSoup, only needed once URLs are ingested
+web = lazy_module("backend.web")
+
+# Corpora of the URLs asked for most recently, shared by every session
+URL_CORPORA_SIZE = int(os.environ.get("PERSONALAI_URL_CORPORA_SIZE", 32))
+_url_corpora = OrderedDict()
+_url_corpora_lock = threading.Lock()
+
 
 # Read from pdf
+@traced()
 def get_pdf_text(file):
-    with pdfplumber.open(file) as pdf:
-        text = ""
-
-        if len(pdf.pages) > 4:
-            raise ValueError("Number of page should be less than 3")
-
-        for page in pdf.pages:
-            text += page.extract_text()
-        return text
+    return "\n".join(iter_pdf_pages(file))
 
 
+@traced()
 def get_fomatted_doc(text: str):
-    llm = ChatOpenAI()
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            (
-                "system",
-                "You are going to recieve a long string text extracted from PDF file. Since it's format got dropped from extraction, I want you to apply format to make it good better.",
-            ),
-            ("user", "{input}"),
-        ]
-    )
+    return get_format_chain().invoke({"input": text})
 
-    output_parser = StrOutputParser()
 
-    chain = prompt | llm | output_parser
-    res = chain.invoke({"input": text})
+@traced()
+def get_translated_doc(text: str):
+    return get_translation_chain().invoke({"input": text})
 
-    return res
 
+@traced()
+def stream_fomatted_doc(text: str):
+    yield from get_format_chain().stream({"input": text})
 
-def get_translated_doc(text: str):
 
-    llm = ChatOpenAI()
-    translation_prompt = ChatPromptTemplate.from_messages(
-        [
-            (
-                "system",
-                "You are tasked with being an excellent English-Korean translator. Your objective is to translate the provided document extracted from a PDF file.",
-            ),
-            (
-                "system",
-                "Present the translation in semantic paragraphs, matching each section of the original text with its corresponding translated segment. Ensure clarity by separating the original text into meaningful units followed by the translation of each respective part",
-            ),
-            ("user", "{input}"),
-        ]
-    )
-    output_parser = StrOutputParser()
+@traced()
+def stream_translated_doc(text: str):
+    yield from get_translation_chain().stream({"input": text})
+
 
-    translation_chain = translation_prompt | llm | output_parser
+def _get_pdf_segments(uploaded_file):
+    # segments are handed to the LLM while later pages are still being parsed
+    pages = iter_pdf_pages(uploaded_file, layout=LAYOUT_FORMATTING)
+    return iter_chunks(pages, split_segments, 2 * SEGMENT_MAX_CHARS)
 
-    res = translation_chain.invoke({"input": text})
-    return res
 
+@traced()
 def get_parsed_translated_text(uploaded_file):
-    # Extract text and render parsed text
-    text = get_pdf_text(uploaded_file)
-    parsed_text = get_fomatted_doc(text)
-    translated_text = get_translated_doc(parsed_text)
+    # Extract text, then format and translate it segment by segment in parallel
+    segments = _get_pdf_segments(uploaded_file)
+    parsed_segments, translated_segments = run_async(translate_segments(segments))
 
-    return parsed_text, translated_text
+    return "\n\n".join(parsed_segments), "\n\n".join(translated_segments)
 
 
 
 # function for RAG
-def get_vectorstore_from_url(url: str):
-    loader = WebBaseLoader(url)
-    document = loader.load()
+def get_embeddings():
+    # PERSONALAI_EMBEDDINGS picks the engine (OpenAI or local CPU);
+    # chunks already embedded for any document are served from the shared cache
+    if EMBEDDING_ENGINE == "openai":
+        # remote API: batch within the account's rate limits; the scheduler
+        # retries rate limit errors itself, so the client must not
+        engine = get_embedding_scheduler(get_openai_embeddings(max_retries=0))
+        return CachedEmbeddings(engine, get_embedding_cache())
+
+    engine = load_embedding_engine()
+    if EMBEDDING_ENGINE == "hashing":
+        # hashing a chunk is cheaper than reading its vector back from SQLite
+        return engine
+    return CachedEmbeddings(engine, get_embedding_cache())
+
+
+@traced()
+def ingest_urls(urls: list, corpus=None):
+    """
+    Fetches urls concurrently (conditional requests against the on-disk
+    HTTP cache) and indexes them into corpus, a new one if not given.
+    Pages already in the corpus with the same content are left alone, so
+    only new or changed pages are chunked and embedded.
+    Returns (corpus, pages).
+    """
+    if corpus is None:
+        corpus = Corpus(get_embeddings(), RecursiveCharacterTextSplitter())
 
-    # split the documents into chunks
-    text_splitter = RecursiveCharacterTextSplitter()
-    document_chunks = text_splitter.split_documents(document)
+    pages = run_async(web.fetch_pages(urls))
+    updated = []
+    for page in pages:
+        if page.content_hash is None:
+            continue
 
-    # create a vectorstore from the chunks
-    vector_stores = Chroma.from_documents(document_chunks, OpenAIEmbeddings())
-    return vector_stores
+        indexed = corpus.documents.get(page.url)
+        if indexed is not None and indexed["metadata"].get("content_hash") == page.content_hash:
+            continue
+
+        corpus.remove_document(page.url)
+        updated.append((page.url, page.text, {"source": page.url, "content_hash": page.content_hash}))
+
+    # one embedding pass over the chunks of every new or changed page
+    corpus.add_documents(updated)
+    return corpus, pages
+
+
+@traced()
+def get_vectorstore_from_url(url: str):
+    """
+    Store over the page at url. The page's corpus is kept between calls,
+    so asking again re-embeds the page only if it changed.
+    Raises ValueError when the page can't be fetched or has no text.
+    """
+    with _url_corpora_lock:
+        corpus = _url_corpora.pop(url, None)
+    corpus, pages = ingest_urls([url], corpus)
+    with _url_corpora_lock:
+        _url_corpora[url] = corpus
+        while len(_url_corpora) > URL_CORPORA_SIZE:
+            _url_corpora.popitem(last=False)
+
+    page = pages[0]
+    if page.content_hash is None:
+        raise ValueError(f"Could not fetch {url}: {page.error}")
+    if corpus.vector_store is None:
+        raise ValueError(f"No text found at {url}")
+    return corpus.vector_store
 
 # def get_text_chunks(text):
 #     text_splitter = CharacterTextSplitter(
@@ -101,28 +166,145 @@ def get_vectorstore_from_url(url: str):
 #     chunks = text_splitter.split_text(text)
 #     return chunks
 
-def get_vectorstore_from_pdf(pdf_text: str):
+def get_pdf_text_splitter():
+    return CharacterTextSplitter(**PDF_CHUNK_PARAMS, length_function=len)
+
+
+def _get_pdf_index_key(content_key: str, embeddings, index_mode: str) -> str:
+    # a saved index is only valid for the same embeddings, index mode and chunking
+    return get_index_key(
+        content_key, embeddings=embeddings.namespace, index_mode=index_mode, **PDF_CHUNK_PARAMS
+    )
+
+
+@traced()
+def get_vectorstore_from_pdf(pdf_text: str, index_key: str = None, index_mode: str = INDEX_MODE):
+    """
+    index_mode is one of backend.vector_index.INDEX_MODES, "flat" keeps the
+    exact float32 index FAISS.from_texts builds.
+    """
     # loader = PyPDFLoader(pdf_text)
     # documents = loader.load() 
 
+    # reuse the index built from the same content
+    embeddings = get_embeddings()
+    if index_key is not None:
+        index_key = _get_pdf_index_key(index_key, embeddings, index_mode)
+        vector_stores = load_vectorstore(index_key, embeddings)
+        if vector_stores is not None:
+            return attach_lexical_index(vector_stores)
+
     # split the documents into chunks
-    text_splitter = CharacterTextSplitter(
-        separator="\n",
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len
-    )
-    text_chunks = text_splitter.split_text(pdf_text)
+    text_chunks = get_pdf_text_splitter().split_text(pdf_text)
 
     # create a vectorstore from the chunks
 
-    vector_stores = FAISS.from_texts(texts=text_chunks, embedding=OpenAIEmbeddings())
+    vector_stores = FAISS.from_texts(
+        texts=text_chunks,
+        embedding=embeddings,
+        metadatas=[{"chunk": i} for i in range(len(text_chunks))],
+    )
+    compress_vectorstore(vector_stores, index_mode)
+
+    if index_key is not None:
+        save_vectorstore(index_key, vector_stores)
+    return attach_lexical_index(vector_stores)
+
+
+@traced()
+def get_vectorstore_from_pdf_file(file, index_mode: str = INDEX_MODE):
+    """
+    Same as get_vectorstore_from_pdf, but a repeat upload of the same bytes
+    loads the saved index without parsing or embedding anything.
+    Otherwise chunks are embedded batch by batch while pages are parsed.
+    """
+    vector_stores = _get_pdf_file_store(file, index_mode)
+    if vector_stores is None:
+        raise ValueError("The PDF has no text layer to index")
+    return attach_lexical_index(vector_stores)
+
+
+def _get_pdf_file_store(file, index_mode: str):
+    # the saved index of the file's bytes, built and saved on first upload
+    embeddings = get_embeddings()
+    index_key = _get_pdf_index_key(get_file_hash(file), embeddings, index_mode)
+
+    vector_stores = load_vectorstore(index_key, embeddings)
+    if vector_stores is not None:
+        return vector_stores
+
+    text_splitter = get_pdf_text_splitter()
+    chunks = iter_chunks(
+        iter_pdf_pages(file), text_splitter.split_text, 2 * PDF_CHUNK_PARAMS["chunk_size"]
+    )
+
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) == EMBEDDING_BATCH_SIZE:
+            vector_stores = _add_texts(vector_stores, batch, embeddings)
+            batch = []
+    if batch:
+        vector_stores = _add_texts(vector_stores, batch, embeddings)
+    if vector_stores is None:
+        # no text layer, e.g. a scanned document
+        return None
+    compress_vectorstore(vector_stores, index_mode)
+
+    save_vectorstore(index_key, vector_stores)
     return vector_stores
 
-def get_context_retriever_chain(vector_store):
-    llm = ChatOpenAI()
 
-    retriever = vector_store.as_retriever()
+def new_corpus():
+    return Corpus(get_embeddings(), get_pdf_text_splitter())
+
+
+def restore_corpus(corpus):
+    # a corpus reloaded from the session store comes without its clients
+    return corpus.restore(get_embeddings(), get_pdf_text_splitter())
+
+
+@traced()
+def add_pdf_to_corpus(corpus, file, doc_id: str, metadata: dict = None):
+    """
+    Adds the PDF to corpus from the file's saved flat index, so a file
+    uploaded before (by any session) is neither parsed nor embedded again.
+    The rest of the corpus is kept.
+    """
+    if doc_id in corpus:
+        return False
+
+    store = _get_pdf_file_store(file, "flat")
+    if store is None:
+        # kept as a document without chunks, the chat reports it
+        return corpus.add_embedded_document(doc_id, [], [], metadata)
+    count = store.index.ntotal
+    chunks = [store.docstore.search(store.index_to_docstore_id[i]).page_content for i in range(count)]
+    vectors = store.index.reconstruct_n(0, count) if count else []
+    return corpus.add_embedded_document(doc_id, chunks, vectors, metadata)
+
+
+def _add_texts(vector_stores, texts: list, embeddings):
+    # chunks are numbered in document order, so neighbours can be merged later
+    start = len(vector_stores.index_to_docstore_id) if vector_stores is not None else 0
+    metadatas = [{"chunk": start + i} for i in range(len(texts))]
+    if vector_stores is None:
+        return FAISS.from_texts(texts=texts, embedding=embeddings, metadatas=metadatas)
+    vector_stores.add_texts(texts, metadatas=metadatas)
+    return vector_stores
+
+
+def get_context_retriever_chain(vector_store, rewrite: str = "auto", doc_ids: tuple = None):
+    """
+    rewrite="always" rephrases every question with the chat history before
+    searching (one extra LLM call per turn); "auto" skips that call when
+    there is no earlier question or the question stands on its own.
+    doc_ids limits the search to those documents of a Corpus.
+    """
+    llm = get_llm()
+
+    # BM25 + vector search; keyword queries never call the embedding API
+    retriever = get_retriever(vector_store, filter={"doc_id": list(doc_ids)} if doc_ids else None)
 
     prompt = ChatPromptTemplate.from_messages(
         [
@@ -137,6 +319,12 @@ def get_context_retriever_chain(vector_store):
 
     retriever_chain = create_history_aware_retriever(llm, retriever, prompt)
 
+    if rewrite == "auto":
+        retriever_chain = RunnableBranch(
+            (needs_query_rewrite, retriever_chain),
+            (lambda x: x["input"]) | retriever,
+        ).with_config(run_name="chat_retriever_chain")
+
     return retriever_chain
 
 
@@ -146,7 +334,7 @@ def get_conversational_rag_chain(retriever_chain):
     And here it connect semantic search and question in LLM
     """
 
-    llm = ChatOpenAI()
+    llm = get_llm()
 
     prompt = ChatPromptTemplate.from_messages(
         [
@@ -161,16 +349,146 @@ def get_conversational_rag_chain(retriever_chain):
 
     stuff_documents_chain = create_stuff_documents_chain(llm, prompt)
 
+    # overlapping chunks are merged and the context is kept within budget
+    context_chain = retriever_chain | RunnableLambda(assemble_context)
+
     # TODO how the chain connects each other
-    return create_retrieval_chain(retriever_chain, stuff_documents_chain)
+    return create_retrieval_chain(context_chain, stuff_documents_chain)
+
 
+def _build_rag_chain(vector_store, doc_ids: tuple = None):
+    retriever_chain = get_context_retriever_chain(vector_store, doc_ids=doc_ids)
+    return get_conversational_rag_chain(retriever_chain)
 
-def get_response(user_input):
-    retriever_chain = get_context_retriever_chain(st.session_state.vector_store)
-    conversation_rag_chain = get_conversational_rag_chain(retriever_chain)
+
+def get_rag_chain(vector_store, doc_ids: tuple = None):
+    # built on the first question about a store, reused for every later turn
+    doc_ids = tuple(sorted(doc_ids)) if doc_ids else None
+    return get_store_chain(vector_store, "rag", _build_rag_chain, doc_ids=doc_ids)
+
+
+def _check_vector_store(vector_store):
+    # a corpus of PDFs without a text layer has nothing to search
+    if vector_store is None:
+        raise ValueError("No text could be read from the uploaded documents")
+
+
+def get_chat_history():
+    # history sent to the LLM: recent turns plus a summary of older ones
+    if "history_window" not in st.session_state:
+        st.session_state.history_window = HistoryWindow()
+    return st.session_state.history_window.messages(st.session_state.chat_history)
+
+
+def _get_store_id(vector_store, doc_ids):
+    # answers are only reusable for a store whose content is known
+    index_key = getattr(vector_store, "index_key", None)
+    if index_key is None or not doc_ids:
+        return index_key
+
+    # a corpus identifies the selected documents by their content
+    content_key = getattr(vector_store, "content_key", None)
+    if content_key is not None:
+        return content_key(doc_ids)
+    return get_cache_key(index_key, sorted(doc_ids))
+
+
+def _get_response_cache_key(vector_store, chat_history, user_input, doc_ids):
+    store_id = _get_store_id(vector_store, doc_ids)
+    if store_id is None:
+        return None
+
+    history = [(message.type, message.content) for message in chat_history]
+    return get_cache_key(f"rag:{store_id}", {"chat_history": history, "input": user_input})
+
+
+def _get_answer_cache_entry(vector_store, chat_history, user_input, doc_ids):
+    """
+    (store id, question, question embedding) the semantic answer cache is
+    looked up with, or None when the answer can't be shared. Follow-up
+    questions mean something else in another conversation, so they are
+    never cached, and keyword questions are answered without an embedding.
+    """
+    store_id = _get_store_id(vector_store, doc_ids)
+    if store_id is None or needs_query_rewrite({"chat_history": chat_history, "input": user_input}):
+        return None
+    lexical_index = getattr(vector_store, "lexical_index", None)
+    filter = {"doc_id": list(doc_ids)} if doc_ids else None
+    if lexical_index is not None and lexical_index.is_keyword_query(user_input, filter):
+        return None
+    return store_id, user_input, get_embeddings().embed_query(user_input)
+
+
+@traced()
+def get_response(user_input, vector_store, use_cache: bool = False, doc_ids: tuple = None,
+                 use_answer_cache: bool = True):
+    """
+    Answers user_input from vector_store (e.g. a Corpus' store).
+    use_cache reuses answers to the exact same question and history,
+    use_answer_cache (on by default) those to similar stand-alone questions.
+    """
+    _check_vector_store(vector_store)
+    chat_history = get_chat_history()
+    cache_key = (
+        _get_response_cache_key(vector_store, chat_history, user_input, doc_ids)
+        if use_cache
+        else None
+    )
+    if cache_key is not None:
+        cached = get_llm_cache().get(cache_key)
+        if cached is not None:
+            return cached.decode("utf-8")
+
+    answer_entry = (
+        _get_answer_cache_entry(vector_store, chat_history, user_input, doc_ids)
+        if use_answer_cache
+        else None
+    )
+    if answer_entry is not None:
+        answer = get_answer_cache().get(*answer_entry)
+        if answer is not None:
+            return answer
+
+    conversation_rag_chain = get_rag_chain(vector_store, doc_ids)
 
     response = conversation_rag_chain.invoke(
-        {"chat_history": st.session_state.chat_history, "input": user_input}
+        {"chat_history": chat_history, "input": user_input}
     )
 
+    if cache_key is not None:
+        get_llm_cache().set(cache_key, response["answer"].encode("utf-8"))
+    if answer_entry is not None:
+        get_answer_cache().set(*answer_entry, response["answer"])
     return response["answer"]
+
+
+@traced()
+def stream_response(user_input, vector_store, doc_ids: tuple = None, use_answer_cache: bool = True):
+    _check_vector_store(vector_store)
+    chat_history = get_chat_history()
+
+    answer_entry = (
+        _get_answer_cache_entry(vector_store, chat_history, user_input, doc_ids)
+        if use_answer_cache
+        else None
+    )
+    if answer_entry is not None:
+        answer = get_answer_cache().get(*answer_entry)
+        if answer is not None:
+            yield answer
+            return
+
+    conversation_rag_chain = get_rag_chain(vector_store, doc_ids)
+
+    # the retrieval chain streams dicts, only the answer is made of tokens
+    tokens = []
+    for chunk in conversation_rag_chain.stream(
+        {"chat_history": chat_history, "input": user_input}
+    ):
+        if "answer" in chunk:
+            tokens.append(chunk["answer"])
+            yield chunk["answer"]
+
+    # a stream that is not consumed to the end is not cached
+    if answer_entry is not None:
+        get_answer_cache().set(*answer_entry, "".join(tokens))
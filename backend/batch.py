@@ -0,0 +1,165 @@
+"""
+Translates every PDF under the given paths, without the Streamlit app.
+
+    OPENAI_API_KEY=... python -m backend.batch papers/ --out translated/ --workers 4 --concurrency 8
+
+For each PDF, <out>/<relative path>.jsonl gets one line per segment as soon
+as it is translated, and <out>/<relative path>.md the whole translation once
+the document is done. PDFs whose .md already exists are skipped, so an
+interrupted run is resumed by running it again; segments translated before
+the interruption come from the LLM response cache.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+from backend.extraction import iter_chunks, iter_pdf_pages
+from backend.registry import run_async
+from backend.translation import (LAYOUT_FORMATTING, SEGMENT_MAX_CHARS, TRANSLATION_CONCURRENCY,
+                                 split_segments, translate_segments)
+
+# Documents in flight at a time; LLM calls are bounded separately
+BATCH_WORKERS = int(os.environ.get("PERSONALAI_BATCH_WORKERS", 4))
+
+
+def find_pdfs(paths: list) -> list:
+    """
+    (path, path relative to its input) of every PDF under paths, sorted.
+    A PDF reached through several inputs is listed once.
+    """
+    found = []
+    seen = set()
+    for path in map(Path, paths):
+        if path.is_dir():
+            pdfs = sorted(
+                pdf for pdf in path.rglob("*") if pdf.suffix.lower() == ".pdf" and pdf.is_file()
+            )
+            candidates = [(pdf, pdf.relative_to(path)) for pdf in pdfs]
+        else:
+            candidates = [(path, Path(path.name))]
+        for pdf, relative in candidates:
+            if pdf.resolve() not in seen:
+                seen.add(pdf.resolve())
+                found.append((pdf, relative))
+    return found
+
+
+def check_outputs(files: list):
+    """
+    Raises ValueError when two PDFs would be written to the same output,
+    e.g. a.pdf in two input directories.
+    """
+    sources = {}
+    for path, relative in files:
+        key = str(relative.with_suffix("")).lower()
+        if key in sources:
+            raise ValueError(
+                f"{sources[key]} and {path} would both be written to {relative.with_suffix('.md')}"
+            )
+        sources[key] = path
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+async def translate_file(path: Path, jsonl_path: Path, md_path: Path, semaphore: asyncio.Semaphore) -> int:
+    """
+    Translates one PDF, appending each finished segment to jsonl_path.
+    Returns the number of segments.
+    """
+    jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+    pages = iter_pdf_pages(path, layout=LAYOUT_FORMATTING)
+    segments = iter_chunks(pages, split_segments, 2 * SEGMENT_MAX_CHARS)
+
+    with open(jsonl_path, "w", encoding="utf-8") as out:
+
+        def on_segment(index, parsed, translated):
+            record = {"file": str(path), "segment": index, "source": parsed, "translation": translated}
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+        _, translated = await translate_segments(segments, on_segment=on_segment, semaphore=semaphore)
+
+    # the .md marks the document as done, write it whole or not at all
+    tmp_path = md_path.with_name(md_path.name + ".tmp")
+    tmp_path.write_text("\n\n".join(translated), encoding="utf-8")
+    os.replace(tmp_path, md_path)
+    return len(translated)
+
+
+async def translate_files(files: list, out_dir: Path, workers: int = BATCH_WORKERS,
+                          concurrency: int = TRANSLATION_CONCURRENCY, overwrite: bool = False) -> dict:
+    """
+    Translates (path, relative path) pairs with at most `workers` documents
+    and `concurrency` LLM calls in flight across all of them. One failed
+    document does not stop the others.
+    Returns {"done", "skipped", "failed"} lists of paths.
+    """
+    check_outputs(files)
+    if workers < 1 or concurrency < 1:
+        raise ValueError("workers and concurrency must be at least 1")
+    documents = asyncio.Semaphore(workers)
+    llm_calls = asyncio.Semaphore(concurrency)
+    summary = {"done": [], "skipped": [], "failed": []}
+
+    async def run(path: Path, relative: Path):
+        md_path = out_dir / relative.with_suffix(".md")
+        if md_path.exists() and not overwrite:
+            summary["skipped"].append(str(path))
+            return
+
+        async with documents:
+            start = time.perf_counter()
+            try:
+                segments = await translate_file(path, md_path.with_suffix(".jsonl"), md_path, llm_calls)
+            except Exception as error:
+                summary["failed"].append(str(path))
+                print(f"failed  {path}: {error!r}", file=sys.stderr)
+                return
+            summary["done"].append(str(path))
+            print(f"done    {path} ({segments} segments, {time.perf_counter() - start:.1f}s)", file=sys.stderr)
+
+    await asyncio.gather(*(run(path, relative) for path, relative in files))
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="PDF files or directories searched recursively")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--workers", type=_positive_int, default=BATCH_WORKERS, help="documents in flight")
+    parser.add_argument("--concurrency", type=_positive_int, default=TRANSLATION_CONCURRENCY,
+                        help="LLM calls in flight, across all documents")
+    parser.add_argument("--overwrite", action="store_true", help="translate PDFs whose output exists")
+    args = parser.parse_args(argv)
+
+    if not os.environ.get("OPENAI_API_KEY"):
+        parser.error("OPENAI_API_KEY is not set")
+
+    files = find_pdfs(args.paths)
+    try:
+        check_outputs(files)
+    except ValueError as error:
+        parser.error(str(error))
+    start = time.perf_counter()
+    summary = run_async(
+        translate_files(files, Path(args.out), args.workers, args.concurrency, args.overwrite)
+    )
+    print(
+        f"{len(summary['done'])} translated, {len(summary['skipped'])} skipped, "
+        f"{len(summary['failed'])} failed in {time.perf_counter() - start:.1f}s",
+        file=sys.stderr,
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import sqlite3
+import threading
+import time
+
+from backend.tracing import count
+
+
+class SqliteLRUCache:
+    """
+    Small key -> bytes store in SQLite, shared by every session of the app.
+    Once more than max_entries rows (or max_bytes of values) are stored the
+    least recently used ones are evicted. Entries older than ttl seconds are
+    treated as missing.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100_000, ttl: float = None,
+                 max_bytes: int = None, name: str = "cache"):
+        self.path = path
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, last_used REAL NOT NULL,"
+            " created REAL NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(entries)")]
+        if "created" not in columns:
+            # caches written before entries had an age
+            self._conn.execute(
+                "ALTER TABLE entries ADD COLUMN created REAL NOT NULL DEFAULT 0"
+            )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_created ON entries (created)"
+        )
+        self._conn.commit()
+        # kept up to date by set_many and _evict, so eviction never rescans the table
+        self._count, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM entries"
+        ).fetchone()
+
+    def _oldest_valid(self, now: float) -> float:
+        return now - self.ttl if self.ttl is not None else float("-inf")
+
+    def get_many(self, keys: list) -> dict:
+        found = {}
+        now = time.time()
+        with self._lock:
+            # stay below SQLite's host parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({placeholders})"
+                    " AND created >= ?",
+                    [*batch, self._oldest_valid(now)],
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                self._conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        count(f"{self.name}_cache_hits", len(found))
+        count(f"{self.name}_cache_misses", len(keys) - len(found))
+        return found
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items: dict):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            # replaced values no longer count
+            keys = list(items)
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                replaced, replaced_bytes = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM entries"
+                    f" WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchone()
+                self._count -= replaced
+                self._bytes -= replaced_bytes
+            self._count += len(items)
+            self._bytes += sum(len(value) for value in items.values())
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, last_used, created)"
+                " VALUES (?, ?, ?, ?)",
+                [(key, value, now, now) for key, value in items.items()],
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def set(self, key: str, value: bytes):
+        self.set_many({key: value})
+
+    def _evict(self, now: float):
+        if self.ttl is not None:
+            oldest = self._oldest_valid(now)
+            expired, expired_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM entries WHERE created < ?",
+                (oldest,),
+            ).fetchone()
+            if expired:
+                self._conn.execute("DELETE FROM entries WHERE created < ?", (oldest,))
+                self._count -= expired
+                self._bytes -= expired_bytes
+
+        overflow = self._count - self.max_entries
+        over_bytes = self._bytes - self.max_bytes if self.max_bytes is not None else 0
+        if overflow <= 0 and over_bytes <= 0:
+            return
+
+        # least recently used first, until both limits are met
+        evicted = []
+        for key, length in self._conn.execute(
+            "SELECT key, LENGTH(value) FROM entries ORDER BY last_used"
+        ):
+            if overflow <= 0 and over_bytes <= 0:
+                break
+            evicted.append((key,))
+            overflow -= 1
+            over_bytes -= length
+            self._count -= 1
+            self._bytes -= length
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+    def __len__(self):
+        with self._lock:
+            return self._count
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,10 @@
+import os
+
+# Root folder for everything the backend persists between runs
+CACHE_DIR = os.environ.get("PERSONALAI_CACHE_DIR", ".cache")
+
+
+def cache_path(*parts: str) -> str:
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
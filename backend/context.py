@@ -0,0 +1,167 @@
+import os
+import re
+
+from langchain_core.documents import Document
+
+from backend.history import estimate_tokens
+from backend.tracing import count
+
+# Tokens of retrieved context stuffed into the answer prompt
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("PERSONALAI_CONTEXT_TOKEN_BUDGET", 1500))
+
+# Passages sharing this share of their word 5-grams say the same thing
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("PERSONALAI_NEAR_DUPLICATE_THRESHOLD", 0.8))
+
+# Overlaps shorter than this are a coincidence, not splitter overlap
+_MIN_OVERLAP_CHARS = 20
+_MAX_OVERLAP_CHARS = 1000
+
+# A passage cut shorter than this is not worth its place in the prompt
+_MIN_PASSAGE_TOKENS = 50
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n")
+_WORD = re.compile(r"\S+")
+
+
+class _Passage:
+    # consecutive text of one source, built from one or more chunks
+    def __init__(self, document: Document):
+        self.metadata = dict(document.metadata)
+        self.text = document.page_content
+        self.source = self.metadata.get("doc_id", self.metadata.get("source"))
+        chunk = self.metadata.get("chunk")
+        self.chunks = [chunk] if chunk is not None else []
+
+    def to_document(self) -> Document:
+        metadata = dict(self.metadata)
+        if self.chunks:
+            metadata["chunk"] = self.chunks[0]
+            metadata["chunks"] = sorted(self.chunks)
+        return Document(page_content=self.text, metadata=metadata)
+
+
+def _overlap(first: str, second: str) -> int:
+    """
+    Length of the longest end of first that second starts with.
+    """
+    for size in range(min(len(first), len(second), _MAX_OVERLAP_CHARS), _MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+
+def _word_overlap(first: str, second: str) -> int:
+    """
+    Length of the start of second whose words end first, whatever the
+    whitespace between them: the splitter may rejoin its overlap differently.
+    """
+    first_words = _WORD.findall(first[-_MAX_OVERLAP_CHARS:])
+    second_words = list(_WORD.finditer(second[:_MAX_OVERLAP_CHARS]))
+    for size in range(min(len(first_words), len(second_words)), 0, -1):
+        end = second_words[size - 1].end()
+        if end < _MIN_OVERLAP_CHARS:
+            break
+        if first_words[-size:] == [word.group() for word in second_words[:size]]:
+            return end
+    return 0
+
+
+def _join(first: _Passage, second: _Passage):
+    """
+    first's text continued by second's, or None if second does not follow
+    first: by chunk number when both have one, otherwise by text the
+    splitter repeated in both.
+    """
+    if first.source != second.source:
+        return None
+    if first.chunks and second.chunks:
+        # a repeated header or footer is no reason to glue distant chunks
+        if min(second.chunks) != max(first.chunks) + 1:
+            return None
+        overlap = _overlap(first.text, second.text) or _word_overlap(first.text, second.text)
+        return first.text + second.text[overlap:] if overlap else f"{first.text}\n{second.text}"
+    overlap = _overlap(first.text, second.text)
+    if overlap:
+        return first.text + second.text[overlap:]
+    return None
+
+
+def _merge(passages: list) -> list:
+    # keeps merging until no two passages touch, a later chunk may bridge two
+    merged = True
+    while merged:
+        merged = False
+        for i, first in enumerate(passages):
+            for j, second in enumerate(passages):
+                if i == j:
+                    continue
+                if second.source == first.source and second.text in first.text:
+                    text = first.text
+                else:
+                    text = _join(first, second)
+                if text is None:
+                    continue
+                # the merged passage keeps the better rank of the two
+                keep, drop = (first, second) if i < j else (second, first)
+                keep.text = text
+                keep.chunks = first.chunks + second.chunks
+                passages.remove(drop)
+                merged = True
+                break
+            if merged:
+                break
+    return passages
+
+
+def _shingles(text: str) -> set:
+    words = text.lower().split()
+    return {" ".join(words[i : i + 5]) for i in range(max(len(words) - 4, 1))}
+
+
+def _drop_near_duplicates(passages: list) -> list:
+    kept, kept_shingles = [], []
+    for passage in passages:
+        shingles = _shingles(passage.text)
+        if any(
+            len(shingles & other) / len(shingles | other) >= NEAR_DUPLICATE_THRESHOLD
+            for other in kept_shingles
+        ):
+            continue
+        kept.append(passage)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    # cut at the last sentence or line end that fits
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    cuts = [match.start() for match in _SENTENCE_END.finditer(text, 0, max_chars)]
+    return text[: cuts[-1]] if cuts else text[:max_chars]
+
+
+def assemble_context(documents: list, token_budget: int = CONTEXT_TOKEN_BUDGET) -> list:
+    """
+    Turns retrieved chunks (best first) into the context of the answer
+    prompt: chunks of the same source that are adjacent or overlap are
+    merged into one passage, near-duplicate passages are dropped, and the
+    best passages are kept within token_budget.
+    """
+    passages = _drop_near_duplicates(_merge([_Passage(document) for document in documents]))
+
+    context, used = [], 0
+    for passage in passages:
+        tokens = estimate_tokens(passage.text)
+        if used + tokens > token_budget:
+            # the first passage that does not fit is cut, the rest left out
+            if token_budget - used >= _MIN_PASSAGE_TOKENS:
+                passage.text = _truncate(passage.text, token_budget - used)
+                context.append(passage)
+            break
+        context.append(passage)
+        used += tokens
+
+    count("context_tokens_retrieved", sum(estimate_tokens(d.page_content) for d in documents))
+    count("context_tokens_kept", sum(estimate_tokens(passage.text) for passage in context))
+    return [passage.to_document() for passage in context]
@@ -0,0 +1,202 @@
+import hashlib
+import sys
+
+import faiss
+from langchain_community.vectorstores import FAISS
+
+from backend.lexical import BM25Index, get_retriever
+from backend.vector_index import INDEX_MODE, compress_vectorstore, delete_vectors
+
+
+class Corpus:
+    """
+    One FAISS store (plus BM25 index) over many documents. Documents are
+    embedded when added and deleted by id, so adding the 11th document costs
+    the embeddings of that document only.
+    Every chunk carries the document metadata plus "doc_id" and "chunk".
+    With a trained index_mode the store is compressed once it holds enough
+    chunks to train on, later documents go straight into the trained index.
+    """
+
+    def __init__(self, embeddings, text_splitter, index_mode: str = INDEX_MODE):
+        self.embeddings = embeddings
+        self.text_splitter = text_splitter
+        self.index_mode = index_mode
+        self.vector_store = None
+        self.documents = {}
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.documents
+
+    def __getstate__(self) -> dict:
+        # the FAISS index is not picklable and the clients are per process,
+        # restore() reattaches them after unpickling
+        state = dict(self.__dict__, embeddings=None, text_splitter=None)
+        store = self.vector_store
+        if store is not None:
+            state["vector_store"] = (
+                faiss.serialize_index(store.index), store.docstore,
+                store.index_to_docstore_id, store.lexical_index,
+            )
+        return state
+
+    def restore(self, embeddings, text_splitter):
+        """
+        Reattaches an unpickled corpus to embeddings and text_splitter.
+        """
+        if self.embeddings is not None:
+            return self
+        self.embeddings = embeddings
+        self.text_splitter = text_splitter
+        if self.vector_store is not None:
+            index, docstore, index_to_docstore_id, lexical_index = self.vector_store
+            self.vector_store = FAISS(
+                embeddings, faiss.deserialize_index(index), docstore, index_to_docstore_id
+            )
+            self.vector_store.lexical_index = lexical_index
+            self._update_keys()
+        return self
+
+    def memory_size(self) -> int:
+        """
+        Rough bytes held by the corpus: index codes, chunk texts and
+        metadata (shared by the docstore and the BM25 index) and the BM25
+        postings.
+        """
+        store = self.vector_store
+        if store is None:
+            return 0
+        if isinstance(store, tuple):
+            # unpickled and not restored yet, the index is still serialized
+            index_bytes, docstore, lexical_index = store[0].nbytes, store[1], store[3]
+        else:
+            try:
+                code_size = store.index.sa_code_size()
+            except RuntimeError:
+                code_size = store.index.d * 4
+            index_bytes, docstore = store.index.ntotal * code_size, store.docstore
+            lexical_index = getattr(store, "lexical_index", None)
+        documents = sum(
+            sys.getsizeof(document.page_content)
+            + sys.getsizeof(document.metadata)
+            + sum(map(sys.getsizeof, document.metadata.values()))
+            for document in docstore._dict.values()
+        )
+        lexical_bytes = lexical_index.memory_size() if lexical_index is not None else 0
+        return index_bytes + documents + lexical_bytes
+
+    def content_key(self, doc_ids: list = None) -> str:
+        """
+        Identifies the indexed content of doc_ids (all documents by default)
+        independently of the ids they were added under.
+        """
+        doc_ids = self.documents if doc_ids is None else doc_ids
+        hashes = sorted(self.documents[doc_id]["content_hash"] for doc_id in doc_ids)
+        namespace = getattr(self.embeddings, "namespace", "")
+        return hashlib.sha256("\0".join([namespace, *hashes]).encode("utf-8")).hexdigest()
+
+    def _update_keys(self):
+        # lets answers about the store be cached like those about a saved index
+        self.vector_store.index_key = self.content_key()
+        self.vector_store.content_key = self.content_key
+
+    def add_document(self, doc_id: str, text: str, metadata: dict = None) -> bool:
+        """
+        Indexes text under doc_id. Returns False if doc_id is already indexed.
+        """
+        return bool(self.add_documents([(doc_id, text, metadata)]))
+
+    def add_documents(self, documents: list) -> list:
+        """
+        Indexes (doc_id, text, metadata) triples with one embedding pass over
+        all their chunks. Returns the doc_ids that were not indexed yet.
+        """
+        chunks, metadatas, ids, added = [], [], [], []
+        for doc_id, text, metadata in documents:
+            if doc_id in self.documents or doc_id in added:
+                continue
+
+            doc_chunks = self.text_splitter.split_text(text)
+            content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            doc_metadatas, doc_ids = self._register(doc_id, len(doc_chunks), metadata, content_hash)
+            chunks.extend(doc_chunks)
+            metadatas.extend(doc_metadatas)
+            ids.extend(doc_ids)
+            added.append(doc_id)
+
+        self._index(chunks, metadatas, ids)
+        if added and self.vector_store is not None:
+            self._update_keys()
+        return added
+
+    def add_embedded_document(self, doc_id: str, chunks: list, vectors, metadata: dict = None) -> bool:
+        """
+        Indexes chunks of doc_id whose vectors are already known, e.g. read
+        back from the document's saved index, without embedding anything.
+        Returns False if doc_id is already indexed.
+        """
+        if doc_id in self.documents:
+            return False
+        content_hash = hashlib.sha256("\0".join(chunks).encode("utf-8")).hexdigest()
+        metadatas, ids = self._register(doc_id, len(chunks), metadata, content_hash)
+        self._index(chunks, metadatas, ids, vectors)
+        if self.vector_store is not None:
+            self._update_keys()
+        return True
+
+    def _register(self, doc_id: str, chunk_count: int, metadata: dict, content_hash: str):
+        # (chunk metadatas, chunk ids) of a new document
+        metadata = dict(metadata or {})
+        ids = [f"{doc_id}:{i}" for i in range(chunk_count)]
+        self.documents[doc_id] = {
+            "metadata": metadata,
+            "chunk_ids": ids,
+            "content_hash": content_hash,
+        }
+        return [{**metadata, "doc_id": doc_id, "chunk": i} for i in range(chunk_count)], ids
+
+    def _index(self, chunks: list, metadatas: list, ids: list, vectors=None):
+        # chunks are embedded here unless their vectors are given
+        if not chunks:
+            return
+        if vectors is None:
+            if self.vector_store is None:
+                self.vector_store = FAISS.from_texts(
+                    chunks, self.embeddings, metadatas=metadatas, ids=ids
+                )
+            else:
+                self.vector_store.add_texts(chunks, metadatas=metadatas, ids=ids)
+        else:
+            pairs = list(zip(chunks, vectors))
+            if self.vector_store is None:
+                self.vector_store = FAISS.from_embeddings(
+                    pairs, self.embeddings, metadatas=metadatas, ids=ids
+                )
+            else:
+                self.vector_store.add_embeddings(pairs, metadatas=metadatas, ids=ids)
+        if getattr(self.vector_store, "lexical_index", None) is None:
+            self.vector_store.lexical_index = BM25Index([])
+        compress_vectorstore(self.vector_store, self.index_mode)
+
+        self.vector_store.lexical_index.add(
+            [self.vector_store.docstore.search(chunk_id) for chunk_id in ids]
+        )
+
+    def remove_document(self, doc_id: str) -> bool:
+        document = self.documents.pop(doc_id, None)
+        if document is None:
+            return False
+
+        if document["chunk_ids"]:
+            delete_vectors(self.vector_store, document["chunk_ids"])
+            self.vector_store.lexical_index.remove({"doc_id": doc_id})
+        if self.vector_store is not None:
+            self._update_keys()
+        return True
+
+    def as_retriever(self, k: int = 4, doc_ids: list = None):
+        """
+        Retriever over the whole corpus, or only over doc_ids.
+        """
+        filter = {"doc_id": list(doc_ids)} if doc_ids else None
+        return get_retriever(self.vector_store, k, filter)
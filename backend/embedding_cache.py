@@ -0,0 +1,72 @@
+import hashlib
+import os
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from backend.cache import SqliteLRUCache
+from backend.config import cache_path
+from backend.embeddings import get_embedding_id
+
+# Upper bound of cached chunk vectors (~6KB each for ada-002)
+EMBEDDING_CACHE_SIZE = int(os.environ.get("PERSONALAI_EMBEDDING_CACHE_SIZE", 200_000))
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model so that chunk texts embedded once, by any
+    document or user, are never sent to the model again. Queries are cached
+    apart from chunks, as models may embed them differently.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: SqliteLRUCache):
+        self.embeddings = embeddings
+        self.cache = cache
+        # vectors of different models must not mix
+        self.namespace = get_embedding_id(embeddings)
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: list) -> list:
+        keys = [self._key(text) for text in texts]
+        cached = self.cache.get_many(list(set(keys)))
+
+        # embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        vectors = {key: array("f", value).tolist() for key, value in cached.items()}
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = dict(zip(missing.keys(), new_vectors))
+            self.cache.set_many(
+                {key: array("f", vector).tobytes() for key, vector in new_items.items()}
+            )
+            vectors.update(new_items)
+
+        return [list(vectors[key]) for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        # the answer cache and the retriever embed the same question
+        key = self._key(f"query\0{text}")
+        cached = self.cache.get(key)
+        if cached is not None:
+            return array("f", cached).tolist()
+        vector = self.embeddings.embed_query(text)
+        self.cache.set(key, array("f", vector).tobytes())
+        return vector
+
+
+_cache = None
+
+
+def get_embedding_cache() -> SqliteLRUCache:
+    global _cache
+    if _cache is None:
+        _cache = SqliteLRUCache(
+            cache_path("embeddings.sqlite3"), EMBEDDING_CACHE_SIZE, name="embedding"
+        )
+    return _cache
@@ -0,0 +1,95 @@
+import os
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from backend.lexical import tokenize
+from backend.registry import get_openai_embeddings
+
+# Which engine embeds chunks and questions: "openai" (default), "hashing"
+# for the local CPU embedder, or "local:<path>" for a sentence-transformers
+# model saved on disk
+EMBEDDING_ENGINE = os.environ.get("PERSONALAI_EMBEDDINGS", "openai")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Local CPU embedder: word unigrams and bigrams are hashed into a fixed
+    number of signed buckets, log-scaled and L2 normalized. No model, no
+    network, and a whole batch is scattered into one NumPy matrix at once.
+    Similarity is lexical, so it suits retrieval over the uploaded document
+    rather than paraphrase matching.
+    """
+
+    def __init__(self, dimensions: int = 1024, batch_size: int = 4096):
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.model = f"hashing-{dimensions}"
+        # used uncached, so it names its vectors like CachedEmbeddings would
+        self.namespace = self.model
+
+    def _hashes(self, text: str, memo: dict) -> list:
+        tokens = tokenize(text)
+        features = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+        # words and bigrams repeat across a batch, each is hashed once
+        missing = {feature for feature in features if feature not in memo}
+        memo.update((feature, zlib.crc32(feature.encode("utf-8"))) for feature in missing)
+        return [memo[feature] for feature in features]
+
+    def _embed_batch(self, texts: list) -> np.ndarray:
+        rows, hashes, memo = [], [], {}
+        for row, text in enumerate(texts):
+            text_hashes = self._hashes(text, memo)
+            rows.extend([row] * len(text_hashes))
+            hashes.extend(text_hashes)
+
+        hashes = np.asarray(hashes, dtype=np.uint32)
+        columns = hashes % self.dimensions
+        # the top bit is independent of the bucket, use it for the sign
+        signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.int64), columns), signs)
+
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def embed_documents(self, texts: list) -> list:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start : start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return self._embed_batch([text])[0].tolist()
+
+
+def get_embedding_id(embeddings) -> str:
+    # names the model, so vectors of different engines never get mixed
+    for attribute in ("model", "model_name"):
+        value = getattr(embeddings, attribute, None)
+        if isinstance(value, str):
+            return value
+    return type(embeddings).__name__
+
+
+_local_models = {}
+
+
+def load_embedding_engine(engine: str = EMBEDDING_ENGINE) -> Embeddings:
+    if engine == "openai":
+        return get_openai_embeddings()
+    if engine == "hashing":
+        return HashingEmbeddings()
+    if engine.startswith("local:"):
+        if engine not in _local_models:
+            # optional dependency: sentence-transformers
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+
+            _local_models[engine] = HuggingFaceEmbeddings(
+                model_name=engine[len("local:"):], encode_kwargs={"batch_size": 256}
+            )
+        return _local_models[engine]
+    raise ValueError(f"Unknown embedding engine: {engine}")
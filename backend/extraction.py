@@ -0,0 +1,132 @@
+import os
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import pdfplumber
+
+from backend.layout import page_to_markdown
+from backend.tracing import count
+
+# Documents with at least this many pages are parsed by a process pool
+PROCESS_POOL_MIN_PAGES = int(os.environ.get("PERSONALAI_PROCESS_POOL_MIN_PAGES", 20))
+
+# Worker processes of the pool, shared by every document of the process
+PROCESS_POOL_SIZE = int(os.environ.get("PERSONALAI_PROCESS_POOL_SIZE", os.cpu_count() or 1))
+
+# Documents each worker keeps open, several are parsed at once in batch runs
+_WORKER_OPEN_DOCUMENTS = 4
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# (path, token) -> open pdfplumber document, in the worker processes
+_worker_pdfs = OrderedDict()
+
+
+def _page_text(page, layout: bool) -> str:
+    if layout:
+        return page_to_markdown(page)
+    return page.extract_text() or ""
+
+
+def _extract_page(path: str, token: str, page_number: int, layout: bool) -> str:
+    # every worker opens a document once and keeps it for its later pages
+    key = (path, token)
+    if key in _worker_pdfs:
+        _worker_pdfs.move_to_end(key)
+    else:
+        _worker_pdfs[key] = pdfplumber.open(path)
+        while len(_worker_pdfs) > _WORKER_OPEN_DOCUMENTS:
+            _worker_pdfs.popitem(last=False)[1].close()
+
+    page = _worker_pdfs[key].pages[page_number]
+    text = _page_text(page, layout)
+    page.flush_cache()
+    return text
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    # one pool per process: forking a new one for every upload is costly,
+    # and concurrent documents would multiply the worker count
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(PROCESS_POOL_SIZE)
+        return _pool
+
+
+def iter_pdf_pages(file, processes: int = None, layout: bool = False):
+    """
+    Yields the text of each page, in order, as soon as it is parsed.
+    Pages without a text layer yield "". layout=True yields Markdown rebuilt
+    from the page layout (backend.layout) instead of plain text.
+
+    processes=None uses the shared process pool for documents of
+    PROCESS_POOL_MIN_PAGES pages or more; processes=0 always parses in the
+    calling thread. Pages not parsed yet are cancelled when the generator
+    is closed early.
+    """
+    if hasattr(file, "seek"):
+        file.seek(0)
+
+    with pdfplumber.open(file) as pdf:
+        page_count = len(pdf.pages)
+        if processes is None:
+            processes = PROCESS_POOL_SIZE if page_count >= PROCESS_POOL_MIN_PAGES else 0
+
+        if processes <= 1:
+            for page in pdf.pages:
+                count("pages")
+                yield _page_text(page, layout)
+                # parsed objects are not needed once the text is out
+                page.flush_cache()
+            return
+
+    # workers open the document by path, uploads are written to a temp file
+    tmp_path = None
+    if isinstance(file, (str, os.PathLike)):
+        path = os.fspath(file)
+    else:
+        file.seek(0)
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            tmp.write(file.read())
+        path = tmp_path = tmp.name
+
+    token = uuid.uuid4().hex
+    futures = [
+        _get_pool().submit(_extract_page, path, token, number, layout) for number in range(page_count)
+    ]
+    try:
+        for future in futures:
+            count("pages")
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        if tmp_path is not None:
+            # workers still parsing a page keep their open handle
+            os.remove(tmp_path)
+
+
+def iter_chunks(pages, split, min_chars: int):
+    """
+    Re-chunks a stream of page texts with split (a str -> list function)
+    so chunks can be consumed before the last page is parsed.
+    The final chunk of every pass is held back and re-split with the next
+    page, so chunks still span page boundaries.
+    """
+    buffer = ""
+    for page in pages:
+        buffer = f"{buffer}\n{page}" if buffer else page
+        if len(buffer) < min_chars:
+            continue
+
+        chunks = split(buffer)
+        yield from chunks[:-1]
+        buffer = chunks[-1] if chunks else ""
+
+    if buffer.strip():
+        yield from split(buffer)
@@ -0,0 +1,104 @@
+import os
+import re
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from backend.registry import get_chain, get_llm
+
+# Tokens of chat history sent along with every question
+HISTORY_TOKEN_BUDGET = int(os.environ.get("PERSONALAI_HISTORY_TOKEN_BUDGET", 1500))
+
+# Words that only make sense with the previous turns in mind
+_REFERENCE_WORDS = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|she|him|her|his|"
+    r"above|previous|earlier|former|latter|same|again|else|one|ones)\b",
+    re.IGNORECASE,
+)
+_FOLLOW_UP_START = re.compile(
+    r"^\s*(and|or|but|also|so|then|what about|how about|why|why not|more)\b",
+    re.IGNORECASE,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English, good enough for budgeting
+    return len(text) // 4 + 1
+
+
+def has_human_turns(chat_history: list) -> bool:
+    return any(isinstance(message, HumanMessage) for message in chat_history)
+
+
+def is_self_contained(question: str) -> bool:
+    """
+    Heuristic: a question that names its subject and does not point back
+    at the conversation can be used as the search query as it is.
+    """
+    if len(question.split()) < 4:
+        return False
+    if _FOLLOW_UP_START.search(question):
+        return False
+    return not _REFERENCE_WORDS.search(question)
+
+
+def needs_query_rewrite(inputs: dict) -> bool:
+    return has_human_turns(inputs["chat_history"]) and not is_self_contained(inputs["input"])
+
+
+def _build_summary_chain(**llm_config):
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            (
+                "system",
+                "Progressively summarize the lines of conversation provided, adding onto the previous summary. Return only the new summary.",
+            ),
+            ("user", "Current summary:\n{summary}\n\nNew lines of conversation:\n{lines}"),
+        ]
+    )
+    return prompt | get_llm(**llm_config) | StrOutputParser()
+
+
+class HistoryWindow:
+    """
+    Keeps the chat history sent to the LLM within a token budget: the most
+    recent turns verbatim, everything older folded into a running summary.
+    The summary is extended only with the turns that just fell out of the
+    window, so each turn costs at most one short summarization call.
+    """
+
+    def __init__(self, token_budget: int = HISTORY_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.summary = ""
+        self.summarized_count = 0
+
+    def _split_point(self, chat_history: list) -> int:
+        # oldest message that still fits, counting back from the newest
+        used = estimate_tokens(self.summary)
+        start = len(chat_history)
+        while start > self.summarized_count:
+            used += estimate_tokens(chat_history[start - 1].content)
+            if used > self.token_budget:
+                break
+            start -= 1
+        return start
+
+    def messages(self, chat_history: list) -> list:
+        start = self._split_point(chat_history)
+
+        if start > self.summarized_count:
+            lines = "\n".join(
+                f"{message.type}: {message.content}"
+                for message in chat_history[self.summarized_count : start]
+            )
+            summary_chain = get_chain("history_summary", _build_summary_chain)
+            self.summary = summary_chain.invoke(
+                {"summary": self.summary or "(empty)", "lines": lines}
+            )
+            self.summarized_count = start
+
+        recent = chat_history[start:]
+        if not self.summary:
+            return recent
+        return [SystemMessage(content=f"Summary of the earlier conversation: {self.summary}")] + recent
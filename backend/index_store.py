@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import uuid
+
+import faiss
+from langchain_community.vectorstores import FAISS
+
+from backend.config import cache_path
+
+
+# On-disk FAISS indexes, addressed by the content they were built from
+def get_file_hash(file) -> str:
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    # Streamlit's UploadedFile is a BytesIO, keep the read position untouched
+    position = file.tell()
+    file.seek(0)
+    digest = hashlib.sha256(file.read()).hexdigest()
+    file.seek(position)
+    return digest
+
+
+def get_index_key(file_hash: str, **params) -> str:
+    payload = json.dumps({"file": file_hash, **params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _index_dir(key: str) -> str:
+    return cache_path("indexes", key)
+
+
+def load_vectorstore(key: str, embedding):
+    """
+    Returns the saved FAISS store for key, or None when it was never built.
+    The index file is memory-mapped so loading does not copy the vectors.
+    """
+    path = _index_dir(key)
+    if not os.path.isdir(path):
+        return None
+
+    index_file = os.path.join(path, "index.faiss")
+    try:
+        index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP)
+    except RuntimeError:
+        # not every index type supports mmap
+        index = faiss.read_index(index_file)
+
+    with open(os.path.join(path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    vector_store = FAISS(embedding, index, docstore, index_to_docstore_id)
+    vector_store.index_key = key
+    return vector_store
+
+
+def save_vectorstore(key: str, vector_store):
+    # identifies the store's content, e.g. for caching answers about it
+    vector_store.index_key = key
+    path = _index_dir(key)
+    if os.path.isdir(path):
+        return
+
+    # write next to the target and swap in, so readers never see half an index
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    vector_store.save_local(tmp_path)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another session saved the same content first
+        shutil.rmtree(tmp_path, ignore_errors=True)
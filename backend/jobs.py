@@ -0,0 +1,291 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.config import cache_path
+from backend.extraction import iter_chunks, iter_pdf_pages
+from backend.registry import run_async
+from backend.translation import (LAYOUT_FORMATTING, SEGMENT_MAX_CHARS, split_segments,
+                                 translate_segments)
+
+# Documents translated at the same time; segments of one document are
+# already parallel
+JOB_WORKERS = int(os.environ.get("PERSONALAI_JOB_WORKERS", 2))
+
+# Job folders not submitted or read for this many seconds are deleted
+JOB_TTL = float(os.environ.get("PERSONALAI_JOB_TTL", 7 * 24 * 3600))
+
+
+def _write_json(path: str, data):
+    # write then rename, a crash never leaves half a checkpoint behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class TranslationJobs:
+    """
+    Translates PDFs on a worker pool, outside the Streamlit script run.
+
+    A job is identified by the PDF content. Its folder holds a copy of the
+    PDF until the job is done, the list of source segments once the PDF is
+    parsed and one checkpoint file per translated segment, so a job
+    interrupted by a restart resumes with the segments that are still
+    missing. Folders unused for ttl seconds are deleted. While a job runs,
+    its progress is also kept in memory, so polling it reads no files.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, ttl: float = JOB_TTL):
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="translation-job")
+        self._lock = threading.Lock()
+        self._running = {}
+        self._errors = {}
+        # job id -> progress of the running job: "segments" {index: (parsed, translated)}
+        # finished, "live" {index: (segment, translated tokens)} being translated, the
+        # "total" once the PDF is parsed, the job "name" and a "revision" bumped on every change
+        self._progress = {}
+        self.ttl = ttl
+        self._remove_stale()
+
+    def _remove_stale(self):
+        # job.json is touched on every submit and result, its age is the job's
+        jobs_dir = os.path.dirname(self._path("", "job.json"))
+        now = time.time()
+        for job_id in os.listdir(jobs_dir):
+            if job_id in self._running:
+                continue
+            try:
+                if now - os.path.getmtime(self._path(job_id, "job.json")) > self.ttl:
+                    shutil.rmtree(os.path.join(jobs_dir, job_id), ignore_errors=True)
+            except OSError:
+                pass
+
+    def _path(self, job_id: str, name: str) -> str:
+        return cache_path("jobs", job_id, name)
+
+    def _segment_path(self, job_id: str, index: int) -> str:
+        return self._path(job_id, f"segment-{index:05d}.json")
+
+    def submit(self, file, name: str = None) -> str:
+        """
+        Starts (or resumes) translating file and returns its job id.
+        Submitting a job that is running or finished does nothing.
+        """
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, "rb") as f:
+                data = f.read()
+        else:
+            file.seek(0)
+            data = file.read()
+
+        payload = f"{hashlib.sha256(data).hexdigest()}:{SEGMENT_MAX_CHARS}:{LAYOUT_FORMATTING}"
+        job_id = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+        with self._lock:
+            self._remove_stale()
+            job_path = self._path(job_id, "job.json")
+            if job_id in self._running or self.poll(job_id)["status"] == "done":
+                os.utime(job_path)
+                return job_id
+
+            source_path = self._path(job_id, "source.pdf")
+            if not os.path.exists(source_path):
+                with open(source_path, "wb") as f:
+                    f.write(data)
+            _write_json(job_path, {"name": name})
+
+            self._errors.pop(job_id, None)
+            self._running[job_id] = self._pool.submit(self._run, job_id)
+        return job_id
+
+    def _missing_segments(self, job_id: str, missing: list, progress: dict):
+        """
+        Yields the segments of job_id without a checkpoint, appending
+        (document index, segment) of each to missing and loading the others
+        into progress. The PDF is parsed as the segments are consumed, then
+        the segment list is saved.
+        """
+        segments_path = self._path(job_id, "segments.json")
+        segments = _read_json(segments_path)
+        if segments is None:
+            pages = iter_pdf_pages(self._path(job_id, "source.pdf"), layout=LAYOUT_FORMATTING)
+            source = iter_chunks(pages, split_segments, 2 * SEGMENT_MAX_CHARS)
+        else:
+            source = segments
+
+        parsed = []
+        for index, segment in enumerate(source):
+            parsed.append(segment)
+            checkpoint = _read_json(self._segment_path(job_id, index))
+            if checkpoint is None:
+                missing.append((index, segment))
+                yield segment
+            else:
+                progress["segments"][index] = (checkpoint["parsed"], checkpoint["translated"])
+                progress["revision"] += 1
+        if segments is None:
+            _write_json(segments_path, parsed)
+        progress["total"] = len(parsed)
+        progress["revision"] += 1
+
+    def _run(self, job_id: str):
+        job = _read_json(self._path(job_id, "job.json")) or {}
+        progress = {"segments": {}, "live": {}, "total": None, "revision": 0, "name": job.get("name")}
+        self._progress[job_id] = progress
+        live = progress["live"]
+        try:
+            missing = []
+            segments = self._missing_segments(job_id, missing, progress)
+
+            def stream(position, token):
+                index, segment = missing[position]
+                if token is None:
+                    # the segment is translated again, its tokens so far are dropped
+                    live[index] = (segment, [])
+                else:
+                    live.setdefault(index, (segment, []))[1].append(token)
+                progress["revision"] += 1
+
+            def checkpoint(position, parsed, translated):
+                index, _ = missing[position]
+                _write_json(
+                    self._segment_path(job_id, index),
+                    {"parsed": parsed, "translated": translated},
+                )
+                progress["segments"][index] = (parsed, translated)
+                live.pop(index, None)
+                progress["revision"] += 1
+
+            run_async(translate_segments(segments, on_segment=checkpoint, on_token=stream))
+            # the copy of the PDF is only needed to resume
+            source_path = self._path(job_id, "source.pdf")
+            if os.path.exists(source_path):
+                os.remove(source_path)
+        except Exception as error:
+            self._errors[job_id] = repr(error)
+            raise
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+                self._progress.pop(job_id, None)
+
+    def poll(self, job_id: str) -> dict:
+        """
+        Returns {"status", "done", "total", "name", "error"}. status is one of
+        "running", "done", "failed", "interrupted" (resume with submit) or
+        "unknown".
+        """
+        progress = self._progress.get(job_id)
+        if progress is not None and job_id in self._running:
+            return {
+                "status": "running",
+                "done": len(progress["segments"]),
+                "total": progress["total"],
+                "name": progress["name"],
+                "error": None,
+            }
+
+        job = _read_json(self._path(job_id, "job.json")) or {}
+        segments = _read_json(self._path(job_id, "segments.json"))
+        total = len(segments) if segments is not None else None
+        if total is None:
+            # the PDF is still being parsed, count the checkpoints there are
+            folder = os.path.dirname(self._path(job_id, "job.json"))
+            done = sum(name.startswith("segment-") for name in os.listdir(folder))
+        else:
+            done = sum(
+                os.path.exists(self._segment_path(job_id, index)) for index in range(total)
+            )
+
+        if job_id in self._running:
+            status = "running"
+        elif job_id in self._errors:
+            status = "failed"
+        elif total is not None and done == total:
+            status = "done"
+        elif job or segments is not None:
+            status = "interrupted"
+        else:
+            status = "unknown"
+
+        return {
+            "status": status,
+            "done": done,
+            "total": total,
+            "name": job.get("name"),
+            "error": self._errors.get(job_id),
+        }
+
+    def partial(self, job_id: str) -> list:
+        """
+        (parsed, translated) pairs of the leading segments finished so far,
+        followed by the tokens translated yet of the segment after them.
+        """
+        progress = self._progress.get(job_id)
+        if progress is not None:
+            results = []
+            finished = progress["segments"]
+            while len(results) in finished:
+                results.append(finished[len(results)])
+            live = progress["live"].get(len(results))
+            if live is not None:
+                segment, tokens = live
+                results.append((segment, "".join(tokens)))
+            return results
+
+        results = []
+        index = 0
+        while True:
+            checkpoint = _read_json(self._segment_path(job_id, index))
+            if checkpoint is None:
+                break
+            results.append((checkpoint["parsed"], checkpoint["translated"]))
+            index += 1
+
+        return results
+
+    def revision(self, job_id: str):
+        """
+        A number that changes whenever the running job's partial() does,
+        None once the job is not running.
+        """
+        progress = self._progress.get(job_id)
+        return progress["revision"] if progress is not None else None
+
+    def result(self, job_id: str):
+        """
+        (parsed_text, translated_text) of a finished job, otherwise None.
+        """
+        if self.poll(job_id)["status"] != "done":
+            return None
+        os.utime(self._path(job_id, "job.json"))
+        results = self.partial(job_id)
+        return (
+            "\n\n".join(parsed for parsed, _ in results),
+            "\n\n".join(translated for _, translated in results),
+        )
+
+
+_jobs = None
+_jobs_lock = threading.Lock()
+
+
+def get_translation_jobs() -> TranslationJobs:
+    # one worker pool per server process, shared by every session
+    global _jobs
+    with _jobs_lock:
+        if _jobs is None:
+            _jobs = TranslationJobs()
+        return _jobs
@@ -0,0 +1,229 @@
+import re
+from collections import Counter
+from statistics import median
+
+# Lines this much larger than the body text are headings
+HEADING_SIZE_RATIO = 1.15
+
+# Two columns need a blank strip this wide (points) on this many rows
+GUTTER_MIN_WIDTH = 12
+COLUMN_MIN_ROWS = 3
+
+_BULLET = re.compile(r"^[•●▪■◦‣∙·*–-]\s+")
+_NUMBERED = re.compile(r"^(\d{1,3}[.)]|\(\d{1,3}\)|\(?[a-z][.)])\s+")
+_SENTENCE_END = re.compile(r"[.!?:;]['\")\]]?$")
+
+
+def _is_bold(fontname: str) -> bool:
+    fontname = fontname.lower()
+    return any(weight in fontname for weight in ("bold", "black", "heavy", "semibold"))
+
+
+def _body_size(words: list) -> float:
+    # the size most of the characters are set in
+    sizes = Counter()
+    for word in words:
+        sizes[round(word["size"], 1)] += len(word["text"])
+    return sizes.most_common(1)[0][0]
+
+
+def _group_rows(words: list) -> list:
+    # words whose tops are within half a font size share a row
+    rows = []
+    for word in sorted(words, key=lambda word: (round(word["top"]), word["x0"])):
+        if rows and abs(word["top"] - rows[-1][0]["top"]) <= word["size"] / 2:
+            rows[-1].append(word)
+        else:
+            rows.append([word])
+    return [sorted(row, key=lambda word: word["x0"]) for row in rows]
+
+
+def _side(row: list, x: float) -> str:
+    """
+    Where the words of a row are relative to x: "left", "right", "split"
+    (on both sides of a blank strip at x) or "full".
+    """
+    left = [word["x1"] for word in row if word["x1"] <= x]
+    right = [word["x0"] for word in row if word["x0"] >= x]
+    if len(left) + len(right) < len(row):
+        return "full"
+    if not right:
+        return "left"
+    if not left:
+        return "right"
+    return "split" if min(right) - max(left) >= GUTTER_MIN_WIDTH else "full"
+
+
+def _find_gutter(rows: list, width: float):
+    # x in the middle of the page that the most rows are split at
+    best, best_split = None, 0
+    for x in range(int(width * 0.3), int(width * 0.7), 2):
+        split = sum(_side(row, x) == "split" for row in rows)
+        if split > best_split:
+            best, best_split = x, split
+    return best if best_split >= COLUMN_MIN_ROWS else None
+
+
+def _regions(rows: list, width: float) -> list:
+    """
+    Rows in reading order, as a list of regions (lists of rows). Where a run
+    of rows is split into two columns the left column is read before the
+    right one; full width rows, e.g. a title above the columns, stay whole.
+    """
+    gutter = _find_gutter(rows, width)
+    if gutter is None:
+        return [rows]
+
+    regions, full, band = [], [], []
+
+    def close_band():
+        if sum(side == "split" for side, _ in band) >= COLUMN_MIN_ROWS:
+            if full:
+                regions.append(list(full))
+                full.clear()
+            for keep in ("left", "right"):
+                column = [
+                    [word for word in row if (word["x1"] <= gutter) == (keep == "left")]
+                    for _, row in band
+                ]
+                regions.append([row for row in column if row])
+        else:
+            full.extend(row for _, row in band)
+        band.clear()
+
+    for row in rows:
+        side = _side(row, gutter)
+        if side == "full":
+            close_band()
+            full.append(row)
+        else:
+            band.append((side, row))
+    close_band()
+    if full:
+        regions.append(full)
+    return regions
+
+
+def _line(row: list) -> dict:
+    bold_chars = sum(len(word["text"]) for word in row if _is_bold(word["fontname"]))
+    return {
+        "text": " ".join(word["text"] for word in row),
+        "x0": row[0]["x0"],
+        "x1": row[-1]["x1"],
+        "top": min(word["top"] for word in row),
+        "bottom": max(word["bottom"] for word in row),
+        "size": median(word["size"] for word in row),
+        "bold": bold_chars * 2 > sum(len(word["text"]) for word in row),
+    }
+
+
+def _join(text: str, line: str) -> str:
+    # undo hyphenation at line ends
+    if text.endswith("-") and line[:1].islower():
+        return text[:-1] + line
+    return f"{text} {line}"
+
+
+def _classify(line: dict, body_size: float, heading_sizes: list):
+    """
+    ("heading", level), ("item", 0) or ("text", 0). Larger sizes make higher
+    level headings; a short bold line at body size is the lowest level.
+    """
+    if line["size"] >= body_size * HEADING_SIZE_RATIO:
+        size = round(line["size"])
+        return "heading", min(heading_sizes.index(size) + 1, 3) if size in heading_sizes else 3
+    if line["bold"] and len(line["text"].split()) <= 12 and not _SENTENCE_END.search(line["text"]):
+        return "heading", min(len(heading_sizes) + 1, 4)
+    if _BULLET.match(line["text"]) or _NUMBERED.match(line["text"]):
+        return "item", 0
+    return "text", 0
+
+
+def _blocks(lines: list, body_size: float, heading_sizes: list) -> list:
+    """
+    Groups the lines of one region into Markdown blocks.
+    """
+    gaps = [b["top"] - a["bottom"] for a, b in zip(lines, lines[1:]) if b["top"] > a["bottom"]]
+    line_gap = median(gaps) if gaps else 0.0
+    left = min(line["x0"] for line in lines)
+    right = max(line["x1"] for line in lines)
+
+    blocks = []
+    kind, text, level, previous, item_x0 = None, "", 0, None, 0.0
+    for line in lines:
+        line_kind, line_level = _classify(line, body_size, heading_sizes)
+
+        gap = line["top"] - previous["bottom"] if previous else 0.0
+        spaced = previous is not None and gap > line_gap * 1.5 + 1
+        continues = (
+            previous is not None
+            and not spaced
+            and line_kind == "text"
+            and (
+                # list items continue on indented lines
+                (kind == "item" and line["x0"] > item_x0 + 1)
+                # paragraphs end at a short line that closes a sentence,
+                # and start with an indented first line
+                or (
+                    kind == "text"
+                    and not (
+                        previous["x1"] < right - (right - left) * 0.15
+                        and _SENTENCE_END.search(previous["text"])
+                    )
+                    and line["x0"] <= left + (right - left) * 0.05
+                )
+            )
+        )
+        if kind == "heading" and line_kind == "heading" and not spaced and line["size"] == previous["size"]:
+            # a heading that wraps over two lines
+            continues = True
+
+        if continues:
+            text = _join(text, line["text"])
+        else:
+            if text:
+                blocks.append(_markdown(kind, text, level))
+            kind, text, level, item_x0 = line_kind, line["text"], line_level, line["x0"]
+        previous = line
+
+    if text:
+        blocks.append(_markdown(kind, text, level))
+    return blocks
+
+
+def _markdown(kind: str, text: str, level: int) -> str:
+    if kind == "heading":
+        return f"{'#' * level} {text}"
+    if kind == "item":
+        bullet = _BULLET.match(text)
+        if bullet:
+            return f"- {text[bullet.end():]}"
+        if text[0].isdigit():
+            return text
+        return f"- {text}"
+    return text
+
+
+def page_to_markdown(page) -> str:
+    """
+    Rebuilds the layout of a pdfplumber page as Markdown from its word
+    geometry: headings from font size and weight, paragraphs from line
+    spacing and indentation, bullet and numbered lists, and two column
+    pages read column by column.
+    """
+    words = page.extract_words(extra_attrs=["size", "fontname"])
+    if not words:
+        return ""
+
+    body_size = _body_size(words)
+    rows = _group_rows(words)
+    row_sizes = [median(word["size"] for word in row) for row in rows]
+    heading_sizes = sorted(
+        {round(size) for size in row_sizes if size >= body_size * HEADING_SIZE_RATIO},
+        reverse=True,
+    )
+
+    blocks = []
+    for region in _regions(rows, page.width):
+        blocks.extend(_blocks([_line(row) for row in region], body_size, heading_sizes))
+    return "\n\n".join(blocks)
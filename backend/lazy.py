@@ -0,0 +1,44 @@
+import importlib
+import threading
+import time
+
+from backend.tracing import record_span
+
+_lock = threading.Lock()
+_modules = {}
+
+
+class LazyModule:
+    """
+    Stands in for a backend module and imports it on first attribute access,
+    so a page only pays for the engines it actually uses. The import time is
+    recorded as an "import:<module>" span.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._module is None:
+                start = time.perf_counter()
+                self._module = importlib.import_module(self.name)
+                record_span(f"import:{self.name}", time.perf_counter() - start)
+        return self._module
+
+    def preload(self):
+        # imports in the background, e.g. while the page waits for an upload
+        if self._module is None:
+            threading.Thread(target=self.load, daemon=True).start()
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+
+def lazy_module(name: str) -> LazyModule:
+    with _lock:
+        if name not in _modules:
+            _modules[name] = LazyModule(name)
+        return _modules[name]
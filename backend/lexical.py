@@ -0,0 +1,243 @@
+import math
+import re
+import sys
+from collections import Counter, defaultdict
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# Words, plus ids such as "PN-00012", "4.2.1" or "ISO_9001" kept in one piece
+_TOKEN = re.compile(r"[0-9A-Za-z]+(?:[-_./][0-9A-Za-z]+)*")
+
+
+def tokenize(text: str) -> list:
+    return [token.lower() for token in _TOKEN.findall(text)]
+
+
+def matches_filter(metadata: dict, filter: dict) -> bool:
+    # same rules as FAISS: equal value, or one of the values of a list
+    for key, value in filter.items():
+        if isinstance(value, list):
+            if metadata.get(key) not in value:
+                return False
+        elif metadata.get(key) != value:
+            return False
+    return True
+
+
+# An id names something specific only if few chunks contain it
+_KEYWORD_MAX_CHUNKS = 3
+_KEYWORD_MAX_SHARE = 0.05
+
+# a (position, frequency) tuple, its list slot and the position int
+_POSTING_BYTES = 56 + 8 + 28
+
+_CLAUSE_ID = re.compile(r"\d+(?:[-_./]\d+){2,}")
+
+
+def _is_identifier(token: str) -> bool:
+    # part numbers ("PN-00012", "A320") and clause ids ("4.2.1"); plain
+    # numbers such as years, and acronyms, are ordinary words
+    has_digit = any(char.isdigit() for char in token)
+    has_letter = any(char.isalpha() for char in token)
+    return has_digit and (has_letter or bool(_CLAUSE_ID.fullmatch(token)))
+
+
+class BM25Index:
+    """
+    In-process inverted index over chunk texts, scored with Okapi BM25.
+    Documents can be added and removed without re-tokenizing the others.
+    """
+
+    def __init__(self, documents: list, k1: float = 1.5, b: float = 0.75):
+        self.documents = []
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.lengths = []
+        self.total_length = 0
+        self.add(documents)
+
+    @property
+    def size(self) -> int:
+        return len(self.documents)
+
+    @property
+    def average_length(self) -> float:
+        return self.total_length / self.size if self.size else 0.0
+
+    def add(self, documents: list):
+        for document in documents:
+            position = len(self.documents)
+            self.documents.append(document)
+            terms = Counter(tokenize(document.page_content))
+            self.lengths.append(sum(terms.values()))
+            self.total_length += self.lengths[-1]
+            for term, frequency in terms.items():
+                self.postings[term].append((position, frequency))
+
+    def remove(self, filter: dict):
+        """
+        Drops every document whose metadata matches filter and its
+        postings, renumbering the positions of the others.
+        """
+        kept = [
+            position
+            for position, document in enumerate(self.documents)
+            if not matches_filter(document.metadata, filter)
+        ]
+        if len(kept) == len(self.documents):
+            return
+
+        new_positions = {position: new for new, position in enumerate(kept)}
+        self.documents = [self.documents[position] for position in kept]
+        self.lengths = [self.lengths[position] for position in kept]
+        self.total_length = sum(self.lengths)
+        postings = defaultdict(list)
+        for term, term_postings in self.postings.items():
+            live = [
+                (new_positions[position], frequency)
+                for position, frequency in term_postings
+                if position in new_positions
+            ]
+            if live:
+                postings[term] = live
+        self.postings = postings
+
+    def count(self, filter: dict = None) -> int:
+        # documents matching filter
+        if not filter:
+            return self.size
+        return sum(1 for document in self.documents if matches_filter(document.metadata, filter))
+
+    def memory_size(self) -> int:
+        """
+        Rough bytes held by the postings; the documents are the docstore's.
+        """
+        postings = sum(len(term_postings) for term_postings in self.postings.values())
+        terms = sum(
+            sys.getsizeof(term) + sys.getsizeof(term_postings)
+            for term, term_postings in self.postings.items()
+        )
+        return postings * _POSTING_BYTES + terms + sys.getsizeof(self.postings) + 8 * len(self.lengths)
+
+    def __contains__(self, term: str) -> bool:
+        return term.lower() in self.postings
+
+    def _idf(self, frequency: int) -> float:
+        return math.log((self.size - frequency + 0.5) / (frequency + 0.5) + 1)
+
+    def search(self, query: str, k: int = 4, filter: dict = None) -> list:
+        """
+        Returns up to k (document, score) pairs, best first, optionally only
+        among documents whose metadata matches filter.
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term, ())
+            idf = self._idf(len(postings))
+            for position, frequency in postings:
+                if filter and not matches_filter(self.documents[position].metadata, filter):
+                    continue
+                length_norm = 1 - self.b + self.b * self.lengths[position] / self.average_length
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[position], score) for position, score in best]
+
+    def is_keyword_query(self, query: str, filter: dict = None) -> bool:
+        """
+        True when the query names an id that occurs in a few of the chunks
+        matching filter, in which case the lexical hits alone are trusted.
+        """
+        max_chunks = max(_KEYWORD_MAX_CHUNKS, self.size * _KEYWORD_MAX_SHARE)
+        for token in _TOKEN.findall(query):
+            if not _is_identifier(token):
+                continue
+            chunks = sum(
+                1
+                for position, _ in self.postings.get(token.lower(), ())
+                if not filter or matches_filter(self.documents[position].metadata, filter)
+            )
+            if 0 < chunks <= max_chunks:
+                return True
+        return False
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses BM25 and vector search results with reciprocal rank fusion.
+    Keyword queries are answered from the BM25 index only, which skips the
+    query embedding round trip.
+    """
+
+    vector_store: Any
+    lexical_index: Any
+    k: int = 4
+    rrf_k: int = 60
+    filter: Optional[dict] = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        lexical_hits = [
+            document
+            for document, _ in self.lexical_index.search(query, self.k * 2, self.filter)
+        ]
+        if lexical_hits and self.lexical_index.is_keyword_query(query, self.filter):
+            return lexical_hits[: self.k]
+
+        search_kwargs = {}
+        if self.filter:
+            search_kwargs = {
+                "filter": self.filter,
+                "fetch_k": get_fetch_k(self.vector_store, self.k * 2, self.lexical_index.count(self.filter)),
+            }
+        vector_hits = self.vector_store.similarity_search(query, k=self.k * 2, **search_kwargs)
+
+        scores = defaultdict(float)
+        by_content = {}
+        for hits in (lexical_hits, vector_hits):
+            for rank, document in enumerate(hits):
+                scores[document.page_content] += 1 / (self.rrf_k + rank + 1)
+                by_content.setdefault(document.page_content, document)
+
+        best = sorted(scores, key=scores.get, reverse=True)[: self.k]
+        return [by_content[content] for content in best]
+
+
+def attach_lexical_index(vector_store, documents: list = None):
+    """
+    Builds the BM25 index next to a vector store. Without documents the
+    chunks are read back from the store's docstore (FAISS).
+    """
+    if documents is None:
+        documents = list(vector_store.docstore._dict.values())
+    vector_store.lexical_index = BM25Index(documents)
+    return vector_store
+
+
+def get_fetch_k(vector_store, k: int, matching: int = None) -> int:
+    """
+    Nearest chunks FAISS fetches before applying a filter that matching of
+    them pass (all of them when unknown). Scaled by the share filtered out,
+    so a small selected document in a large corpus still gets k hits.
+    """
+    total = vector_store.index.ntotal
+    if not matching:
+        return total
+    return min(total, max(20, 4 * k * math.ceil(total / matching)))
+
+
+def get_retriever(vector_store, k: int = 4, filter: dict = None):
+    lexical_index = getattr(vector_store, "lexical_index", None)
+    if lexical_index is None:
+        search_kwargs = {"k": k}
+        if filter:
+            search_kwargs.update(filter=filter, fetch_k=get_fetch_k(vector_store, k))
+        return vector_store.as_retriever(search_kwargs=search_kwargs)
+    return HybridRetriever(
+        vector_store=vector_store, lexical_index=lexical_index, k=k, filter=filter
+    )
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+
+from langchain_core.runnables import Runnable
+
+from backend.cache import SqliteLRUCache
+from backend.config import cache_path
+
+# Responses are kept for LLM_CACHE_TTL seconds, within LLM_CACHE_MAX_BYTES
+LLM_CACHE_TTL = float(os.environ.get("PERSONALAI_LLM_CACHE_TTL", 30 * 24 * 3600))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("PERSONALAI_LLM_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def get_cache_namespace(prompt, llm) -> str:
+    """
+    Identifies a (prompt template, model) pair: changing the prompt text or
+    the model settings starts from an empty cache.
+    """
+    model = {"model": llm.model_name, "temperature": llm.temperature}
+    payload = json.dumps({"prompt": repr(prompt), "model": model}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_cache_key(namespace: str, inputs) -> str:
+    payload = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(f"{namespace}\0{payload}".encode("utf-8")).hexdigest()
+
+
+class CachedChain(Runnable):
+    """
+    Wraps a chain that returns a string so that an input seen before, by any
+    session or a previous run of the app, is answered from the cache.
+    Streams of a cached response yield the whole text at once; a stream that
+    is not consumed to the end is not cached.
+    """
+
+    def __init__(self, chain: Runnable, namespace: str, cache: SqliteLRUCache):
+        self.chain = chain
+        self.namespace = namespace
+        self.cache = cache
+
+    def _lookup(self, input):
+        key = get_cache_key(self.namespace, input)
+        value = self.cache.get(key)
+        return key, value.decode("utf-8") if value is not None else None
+
+    def _store(self, key: str, output: str):
+        self.cache.set(key, output.encode("utf-8"))
+
+    def invoke(self, input, config=None, **kwargs):
+        key, output = self._lookup(input)
+        if output is None:
+            output = self.chain.invoke(input, config, **kwargs)
+            self._store(key, output)
+        return output
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        key, output = self._lookup(input)
+        if output is None:
+            output = await self.chain.ainvoke(input, config, **kwargs)
+            self._store(key, output)
+        return output
+
+    def stream(self, input, config=None, **kwargs):
+        key, output = self._lookup(input)
+        if output is not None:
+            yield output
+            return
+
+        tokens = []
+        for token in self.chain.stream(input, config, **kwargs):
+            tokens.append(token)
+            yield token
+        self._store(key, "".join(tokens))
+
+    async def astream(self, input, config=None, **kwargs):
+        key, output = self._lookup(input)
+        if output is not None:
+            yield output
+            return
+
+        tokens = []
+        async for token in self.chain.astream(input, config, **kwargs):
+            tokens.append(token)
+            yield token
+        self._store(key, "".join(tokens))
+
+
+_cache = None
+
+
+def get_llm_cache() -> SqliteLRUCache:
+    global _cache
+    if _cache is None:
+        _cache = SqliteLRUCache(
+            cache_path("llm_responses.sqlite3"),
+            max_entries=1_000_000,
+            ttl=LLM_CACHE_TTL,
+            max_bytes=LLM_CACHE_MAX_BYTES,
+            name="llm",
+        )
+    return _cache
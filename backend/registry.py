@@ -0,0 +1,144 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+from collections import defaultdict
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from backend.tracing import count
+
+# Clients and chains are built once per process and shared by every session.
+# Reusing a client also reuses its pooled HTTP connections.
+_lock = threading.RLock()
+_clients = {}
+_chains = {}
+
+_loop = None
+
+
+class TokenCountingHandler(BaseCallbackHandler):
+    """
+    Adds prompt/completion token counts of every LLM call to the current span.
+    Streamed calls usually come without usage data, so their generated
+    tokens are counted as they arrive.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._streamed = defaultdict(int)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        self._streamed[run_id] += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        streamed = self._streamed.pop(run_id, 0)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        count("llm_calls")
+        count("prompt_tokens", usage.get("prompt_tokens", 0))
+        count("completion_tokens", usage.get("completion_tokens", streamed))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._streamed.pop(run_id, None)
+        count("llm_errors")
+
+
+token_counter = TokenCountingHandler()
+
+
+def _config_key(config: dict):
+    return tuple(sorted(config.items()))
+
+
+def get_llm(**config) -> ChatOpenAI:
+    key = ("llm", _config_key(config))
+    with _lock:
+        if key not in _clients:
+            _clients[key] = ChatOpenAI(callbacks=[token_counter], **config)
+        return _clients[key]
+
+
+def get_openai_embeddings(**config) -> OpenAIEmbeddings:
+    key = ("embeddings", _config_key(config))
+    with _lock:
+        if key not in _clients:
+            _clients[key] = OpenAIEmbeddings(**config)
+        return _clients[key]
+
+
+def get_chain(name: str, build, **config):
+    """
+    Returns the chain registered under (name, config), calling build(**config)
+    the first time.
+    """
+    key = (name, _config_key(config))
+    with _lock:
+        if key not in _chains:
+            _chains[key] = build(**config)
+        return _chains[key]
+
+
+def get_store_chain(vector_store, name: str, build, **config):
+    # chains bound to a vector store live on the store and go away with it;
+    # a WeakKeyDictionary would never drop them, the chains reference the store
+    key = (name, _config_key(config))
+    with _lock:
+        chains = vector_store.__dict__.setdefault("store_chains", {})
+        if key not in chains:
+            chains[key] = build(vector_store, **config)
+        return chains[key]
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    One event loop running in a background thread for all async LLM work.
+    The async HTTP clients keep their connections bound to the loop that
+    opened them, so they must not be shared across asyncio.run() calls.
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+        return _loop
+
+
+def submit(coro) -> concurrent.futures.Future:
+    """
+    Schedules coro on the shared loop. Unlike run_coroutine_threadsafe the
+    coroutine runs in a copy of the caller's context (e.g. its trace span).
+    Cancelling the returned future cancels the coroutine.
+    """
+    loop = get_event_loop()
+    context = contextvars.copy_context()
+    future = concurrent.futures.Future()
+
+    def on_done(task):
+        if future.cancelled():
+            return
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def start():
+        if future.cancelled():
+            coro.close()
+            return
+        task = context.run(loop.create_task, coro)
+        task.add_done_callback(on_done)
+        future.add_done_callback(
+            lambda future: future.cancelled() and loop.call_soon_threadsafe(task.cancel)
+        )
+
+    loop.call_soon_threadsafe(start)
+    return future
+
+
+def run_async(coro):
+    # blocks the calling thread until coro finishes on the shared loop
+    return submit(coro).result()
@@ -0,0 +1,188 @@
+import asyncio
+import os
+import random
+import time
+
+from langchain_core.embeddings import Embeddings
+
+from backend.embeddings import get_embedding_id
+from backend.history import estimate_tokens
+from backend.registry import run_async
+from backend.tracing import count
+
+# Budgets of the embedding API account, shared by every session
+EMBEDDING_RPM = int(os.environ.get("PERSONALAI_EMBEDDING_RPM", 3000))
+EMBEDDING_TPM = int(os.environ.get("PERSONALAI_EMBEDDING_TPM", 1_000_000))
+EMBEDDING_CONCURRENCY = int(os.environ.get("PERSONALAI_EMBEDDING_CONCURRENCY", 4))
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    status = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    return status == 429 or "RateLimit" in type(error).__name__
+
+
+def _retry_after(error: Exception):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Token bucket refilled continuously up to `per_minute` units per minute.
+    pause() empties it, so every waiter backs off after a 429.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.available = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = None
+
+    def _refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        amount = min(amount, self.capacity)
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                await asyncio.sleep((amount - self.available) / self.rate)
+
+    def pause(self, seconds: float):
+        self.available = 0.0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class EmbeddingScheduler(Embeddings):
+    """
+    Sends chunks to an embedding model in token-sized batches, several at a
+    time, within requests-per-minute and tokens-per-minute budgets. Rate
+    limit errors are retried with exponential backoff (or the server's
+    Retry-After) and pause every other batch as well.
+    The wrapped client should not retry on its own (max_retries=0), or its
+    retries compound with these.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_batch_tokens: int = 50_000,
+        max_batch_size: int = 512,
+        concurrency: int = EMBEDDING_CONCURRENCY,
+        requests_per_minute: int = EMBEDDING_RPM,
+        tokens_per_minute: int = EMBEDDING_TPM,
+        max_retries: int = 8,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.embeddings = embeddings
+        self.model = get_embedding_id(embeddings)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.concurrency = concurrency
+        self.requests = RateLimiter(requests_per_minute)
+        self.tokens = RateLimiter(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limited = 0
+
+    def make_batches(self, texts: list) -> list:
+        """
+        Packs consecutive texts into batches of at most max_batch_tokens
+        (estimated) and max_batch_size texts. Returns (start, texts, tokens).
+        """
+        batches = []
+        start, batch, tokens = 0, [], 0
+        for position, text in enumerate(texts):
+            text_tokens = estimate_tokens(text)
+            if batch and (
+                tokens + text_tokens > self.max_batch_tokens or len(batch) == self.max_batch_size
+            ):
+                batches.append((start, batch, tokens))
+                start, batch, tokens = position, [], 0
+            batch.append(text)
+            tokens += text_tokens
+        if batch:
+            batches.append((start, batch, tokens))
+        return batches
+
+    async def _request(self, make_request, tokens: int, semaphore: asyncio.Semaphore):
+        # make_request() starts one API call, retried here on rate limits
+        for attempt in range(self.max_retries + 1):
+            await self.requests.acquire(1)
+            await self.tokens.acquire(tokens)
+            async with semaphore:
+                try:
+                    return await make_request()
+                except Exception as error:
+                    if not is_rate_limit_error(error) or attempt == self.max_retries:
+                        raise
+                    error_delay = _retry_after(error)
+
+            self.rate_limited += 1
+            count("embedding_rate_limited")
+            delay = error_delay
+            if delay is None:
+                delay = min(self.max_delay, self.base_delay * 2**attempt)
+                delay *= random.uniform(0.5, 1.0)
+            self.requests.pause(delay)
+
+    async def aembed_documents(self, texts: list) -> list:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        batches = self.make_batches(texts)
+        results = await asyncio.gather(
+            *(
+                self._request(lambda batch=batch: self.embeddings.aembed_documents(batch), tokens, semaphore)
+                for _, batch, tokens in batches
+            )
+        )
+
+        vectors = [None] * len(texts)
+        for (start, batch, _), batch_vectors in zip(batches, results):
+            vectors[start : start + len(batch)] = batch_vectors
+        return vectors
+
+    def embed_documents(self, texts: list) -> list:
+        if not texts:
+            return []
+        # runs on the shared loop, where the async HTTP client lives
+        return run_async(self.aembed_documents(texts))
+
+    def embed_query(self, text: str) -> list:
+        # within the same budgets, and retried like the documents
+        request = self._request(
+            lambda: self.embeddings.aembed_query(text), estimate_tokens(text), asyncio.Semaphore(1)
+        )
+        return run_async(request)
+
+
+_schedulers = {}
+
+
+def get_embedding_scheduler(embeddings: Embeddings) -> EmbeddingScheduler:
+    # one scheduler per model, so its budgets cover every session
+    key = get_embedding_id(embeddings)
+    if key not in _schedulers or _schedulers[key].embeddings is not embeddings:
+        _schedulers[key] = EmbeddingScheduler(embeddings)
+    return _schedulers[key]
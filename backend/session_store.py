@@ -0,0 +1,293 @@
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+import uuid
+import weakref
+import zlib
+from collections import OrderedDict
+
+from backend.config import cache_path
+from backend.tracing import count
+
+# Bytes of documents kept in memory for one session and for all sessions
+# together; past either budget the least recently used ones go to disk
+SESSION_MEMORY_BUDGET = int(os.environ.get("PERSONALAI_SESSION_MEMORY_BUDGET", 64 * 2**20))
+GLOBAL_MEMORY_BUDGET = int(os.environ.get("PERSONALAI_GLOBAL_MEMORY_BUDGET", 512 * 2**20))
+
+# Spilled documents left behind by a previous server process are deleted
+# once they are this many seconds old
+SPILL_TTL = float(os.environ.get("PERSONALAI_SPILL_TTL", 24 * 3600))
+
+
+def estimate_size(value) -> int:
+    """
+    Rough bytes held by value. Objects may report their own memory_size().
+    """
+    memory_size = getattr(value, "memory_size", None)
+    if callable(memory_size):
+        return memory_size()
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(key) + estimate_size(item) for key, item in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(map(estimate_size, value))
+    return sys.getsizeof(value)
+
+
+class SessionDocumentStore:
+    """
+    Documents of every session (parsed and translated text, chat corpora),
+    kept in memory within a per-session and a global byte budget. Past
+    either budget the least recently used entries are pickled, compressed
+    and written to spill_dir, then loaded back the next time they are read.
+    Entries are written and read outside the lock, and an entry checked out
+    by its session (to be changed in place) is not spilled until it is put
+    again, which also re-measures it.
+    """
+
+    def __init__(self, spill_dir: str, session_budget: int = SESSION_MEMORY_BUDGET,
+                 global_budget: int = GLOBAL_MEMORY_BUDGET, ttl: float = SPILL_TTL):
+        self.spill_dir = spill_dir
+        self.session_budget = session_budget
+        self.global_budget = global_budget
+        self._lock = threading.Lock()
+        # (session id, key) -> (value, size), least recently used first
+        self._memory = OrderedDict()
+        self._session_bytes = {}
+        self._bytes = 0
+        # (session id, key) -> file of the entries on disk
+        self._spilled = {}
+        # (session id, key) -> value of the entries being written to disk
+        self._spilling = {}
+        # (session id, key) of the entries their session is changing
+        self._checked_out = set()
+        os.makedirs(spill_dir, exist_ok=True)
+        self._remove_stale(ttl)
+
+    def _remove_stale(self, ttl: float):
+        now = time.time()
+        for name in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, name)
+            try:
+                if now - os.path.getmtime(path) > ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _path(self, entry: tuple) -> str:
+        # a new file per spill, so a write that lost a race never removes a newer one
+        name = hashlib.sha256("\0".join(map(str, entry)).encode("utf-8")).hexdigest()
+        return os.path.join(self.spill_dir, f"{name}.{uuid.uuid4().hex}.pkl.z")
+
+    def _forget(self, entry: tuple):
+        if entry in self._memory:
+            _, size = self._memory.pop(entry)
+            self._session_bytes[entry[0]] -= size
+            self._bytes -= size
+        # a write in progress sees the entry is gone and drops its file
+        self._spilling.pop(entry, None)
+        path = self._spilled.pop(entry, None)
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _insert(self, entry: tuple, value) -> list:
+        size = estimate_size(value)
+        self._memory[entry] = (value, size)
+        self._session_bytes[entry[0]] = self._session_bytes.get(entry[0], 0) + size
+        self._bytes += size
+        return self._evict(entry)
+
+    def _take_for_spill(self, entry: tuple) -> tuple:
+        value, size = self._memory.pop(entry)
+        self._session_bytes[entry[0]] -= size
+        self._bytes -= size
+        self._spilling[entry] = value
+        return entry, value
+
+    def _evict(self, keep: tuple) -> list:
+        """
+        Takes the entries to spill out of memory and returns them as
+        (entry, value) pairs, for _spill to write once the lock is released.
+        """
+        # the entry just used stays in memory, even if it is over budget alone
+        session_id = keep[0]
+        victims = []
+        for entry in [entry for entry in self._memory if entry[0] == session_id]:
+            if self._session_bytes[session_id] <= self.session_budget:
+                break
+            if entry != keep and entry not in self._checked_out:
+                victims.append(self._take_for_spill(entry))
+        for entry in list(self._memory):
+            if self._bytes <= self.global_budget:
+                break
+            if entry != keep and entry not in self._checked_out:
+                victims.append(self._take_for_spill(entry))
+        return victims
+
+    def _spill(self, victims: list):
+        for entry, value in victims:
+            path = self._path(entry)
+            try:
+                data = zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 3)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except Exception:
+                # changed while it was pickled, or the disk failed: keep it in memory
+                with self._lock:
+                    if self._spilling.get(entry) is value:
+                        del self._spilling[entry]
+                        self._insert_kept(entry, value)
+                continue
+
+            with self._lock:
+                # read back, put again or removed while it was written
+                written = self._spilling.get(entry) is value
+                if written:
+                    del self._spilling[entry]
+                    self._spilled[entry] = path
+            if not written:
+                os.remove(path)
+                continue
+            count("session_spills")
+            count("session_spilled_bytes", len(data))
+
+    def _insert_kept(self, entry: tuple, value):
+        # back in memory without evicting anything, the budgets are caught up on the next put
+        size = estimate_size(value)
+        self._memory[entry] = (value, size)
+        self._session_bytes[entry[0]] = self._session_bytes.get(entry[0], 0) + size
+        self._bytes += size
+
+    def put(self, session_id: str, key: str, value):
+        entry = (session_id, key)
+        with self._lock:
+            self._checked_out.discard(entry)
+            self._forget(entry)
+            victims = self._insert(entry, value)
+        self._spill(victims)
+
+    def get(self, session_id: str, key: str, default=None, checkout: bool = False):
+        """
+        The entry's value, or default. With checkout the value is not
+        spilled until it is put again.
+        """
+        entry = (session_id, key)
+        victims = []
+        path = None
+        with self._lock:
+            if entry in self._memory:
+                self._memory.move_to_end(entry)
+                value = self._memory[entry][0]
+            elif entry in self._spilling:
+                # still being written, the write is dropped
+                value = self._spilling.pop(entry)
+                victims = self._insert(entry, value)
+            elif entry in self._spilled:
+                path = self._spilled.pop(entry)
+            else:
+                return default
+            if checkout:
+                self._checked_out.add(entry)
+
+        if path is not None:
+            try:
+                with open(path, "rb") as f:
+                    value = pickle.loads(zlib.decompress(f.read()))
+                os.remove(path)
+            except OSError:
+                # deleted as stale, the caller rebuilds it
+                return default
+            count("session_reloads")
+            with self._lock:
+                if entry in self._memory:
+                    # put again while it was read
+                    value = self._memory[entry][0]
+                else:
+                    victims = self._insert(entry, value)
+        self._spill(victims)
+        return value
+
+    def contains(self, session_id: str, key: str) -> bool:
+        entry = (session_id, key)
+        with self._lock:
+            return entry in self._memory or entry in self._spilling or entry in self._spilled
+
+    def remove(self, session_id: str, key: str):
+        with self._lock:
+            self._checked_out.discard((session_id, key))
+            self._forget((session_id, key))
+
+    def drop_session(self, session_id: str):
+        with self._lock:
+            entries = [*self._memory, *self._spilling, *self._spilled, *self._checked_out]
+            for entry in [e for e in entries if e[0] == session_id]:
+                self._checked_out.discard(entry)
+                self._forget(entry)
+            self._session_bytes.pop(session_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memory_bytes": self._bytes,
+                "in_memory": len(self._memory),
+                "spilled": len(self._spilled) + len(self._spilling),
+                "sessions": len(self._session_bytes),
+            }
+
+
+class SessionDocuments:
+    """
+    Dict-like view of one session's entries in a SessionDocumentStore.
+    Kept in st.session_state, so once Streamlit discards the session the
+    view is garbage collected and the session's entries are dropped, in
+    memory and on disk.
+    """
+
+    def __init__(self, store: SessionDocumentStore):
+        self.store = store
+        self.session_id = uuid.uuid4().hex
+        weakref.finalize(self, store.drop_session, self.session_id)
+
+    def get(self, key: str, default=None):
+        return self.store.get(self.session_id, key, default)
+
+    def checkout(self, key: str, default=None):
+        # for a value changed in place, kept in memory until it is set again
+        return self.store.get(self.session_id, key, default, checkout=True)
+
+    def __getitem__(self, key: str):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value):
+        self.store.put(self.session_id, key, value)
+
+    def __delitem__(self, key: str):
+        self.store.remove(self.session_id, key)
+
+    def __contains__(self, key: str) -> bool:
+        return self.store.contains(self.session_id, key)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionDocumentStore:
+    # one store per server process, shared by every session
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionDocumentStore(cache_path("sessions"))
+        return _store
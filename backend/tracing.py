@@ -0,0 +1,223 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Opt-in: PERSONALAI_TRACE=1, or enable_tracing() at runtime.
+# Finished spans are appended to PERSONALAI_TRACE_FILE when it is set.
+_enabled = os.environ.get("PERSONALAI_TRACE", "") not in ("", "0")
+_trace_file = os.environ.get("PERSONALAI_TRACE_FILE")
+
+_current_span = contextvars.ContextVar("personalai_span", default=None)
+_lock = threading.Lock()
+_recent = deque(maxlen=1000)
+_totals = defaultdict(float)
+
+
+class Span:
+    def __init__(self, stage: str, parent=None):
+        self.id = uuid.uuid4().hex[:16]
+        self.stage = stage
+        self.parent_span = parent
+        self.parent = parent.id if parent is not None else None
+        self.start = time.time()
+        self.seconds = None
+        self.first_output_seconds = None
+        self.counters = defaultdict(int)
+        self.error = None
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "parent": self.parent,
+            "stage": self.stage,
+            "start": self.start,
+            "seconds": self.seconds,
+            "first_output_seconds": self.first_output_seconds,
+            "error": self.error,
+            **self.counters,
+        }
+
+
+def enable_tracing(trace_file: str = None):
+    global _enabled, _trace_file
+    _enabled = True
+    if trace_file is not None:
+        _trace_file = trace_file
+
+
+def disable_tracing():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _finish(span: Span):
+    record = span.to_dict()
+    with _lock:
+        _recent.append(record)
+        _totals[("seconds", span.stage, "")] += span.seconds
+        _totals[("count", span.stage, "")] += 1
+        for name, value in span.counters.items():
+            _totals[("counter", span.stage, name)] += value
+        if _trace_file:
+            with open(_trace_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+@contextmanager
+def trace_span(stage: str):
+    if not _enabled:
+        yield None
+        return
+
+    span = Span(stage, _current_span.get())
+    token = _current_span.set(span)
+    started = time.perf_counter()
+    try:
+        yield span
+    except BaseException as error:
+        span.error = type(error).__name__
+        raise
+    finally:
+        span.seconds = time.perf_counter() - started
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # a traced generator closed from another context
+            _current_span.set(span.parent_span)
+        _finish(span)
+
+
+def record_span(stage: str, seconds: float, **counters):
+    # for work timed elsewhere, e.g. a whole Streamlit rerun
+    if not _enabled:
+        return
+    span = Span(stage, _current_span.get())
+    span.seconds = seconds
+    for name, value in counters.items():
+        span.count(name, value)
+    _finish(span)
+
+
+def count(name: str, value: int = 1):
+    # adds to the innermost open span, if any
+    span = _current_span.get()
+    if span is not None:
+        span.count(name, value)
+
+
+def traced(stage: str = None):
+    """
+    Decorator recording a span for every call. Generators are timed until
+    exhausted, with the delay before their first item as first_output_seconds.
+    """
+
+    def decorator(func):
+        name = stage or func.__name__
+
+        if inspect.isgeneratorfunction(func):
+
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                if not _enabled:
+                    yield from func(*args, **kwargs)
+                    return
+
+                span = Span(name, _current_span.get())
+                started = time.perf_counter()
+                generator = func(*args, **kwargs)
+                try:
+                    while True:
+                        # the span is current while the generator runs, not
+                        # while the consumer handles its items
+                        token = _current_span.set(span)
+                        try:
+                            item = next(generator)
+                        except StopIteration:
+                            return
+                        finally:
+                            _current_span.reset(token)
+                        if span.first_output_seconds is None:
+                            span.first_output_seconds = time.perf_counter() - started
+                        yield item
+                except GeneratorExit:
+                    raise
+                except BaseException as error:
+                    span.error = type(error).__name__
+                    raise
+                finally:
+                    token = _current_span.set(span)
+                    try:
+                        generator.close()
+                    finally:
+                        _current_span.reset(token)
+                    span.seconds = time.perf_counter() - started
+                    _finish(span)
+
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace_span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def recent_spans(limit: int = 100) -> list:
+    with _lock:
+        return list(_recent)[-limit:]
+
+
+def jsonl_text() -> str:
+    return "".join(json.dumps(record) + "\n" for record in recent_spans(_recent.maxlen))
+
+
+def export_jsonl(path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(jsonl_text())
+
+
+def prometheus_text() -> str:
+    """
+    Totals since start in the Prometheus text exposition format.
+    """
+    lines = [
+        "# HELP personalai_stage_seconds Wall time spent per backend stage.",
+        "# TYPE personalai_stage_seconds summary",
+    ]
+    with _lock:
+        totals = dict(_totals)
+
+    stages = sorted({stage for _, stage, _ in totals})
+    for stage in stages:
+        lines.append(
+            f'personalai_stage_seconds_sum{{stage="{stage}"}} {totals.get(("seconds", stage, ""), 0.0):.6f}'
+        )
+        lines.append(
+            f'personalai_stage_seconds_count{{stage="{stage}"}} {int(totals.get(("count", stage, ""), 0))}'
+        )
+
+    lines.append("# HELP personalai_stage_events_total Tokens, LLM calls and cache lookups per stage.")
+    lines.append("# TYPE personalai_stage_events_total counter")
+    for (kind, stage, name), value in sorted(totals.items()):
+        if kind == "counter":
+            lines.append(
+                f'personalai_stage_events_total{{stage="{stage}",event="{name}"}} {int(value)}'
+            )
+    return "\n".join(lines) + "\n"
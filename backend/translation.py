@@ -0,0 +1,387 @@
+import asyncio
+import os
+import re
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from backend.llm_cache import CachedChain, get_cache_namespace, get_llm_cache
+from backend.registry import get_chain, get_llm
+from backend.tracing import count, trace_span
+from backend.translation_memory import TRANSLATION_MEMORY, get_translation_memory
+
+# Segments are translated independently, so a longer document means more
+# segments in flight rather than one longer prompt
+SEGMENT_MAX_CHARS = int(os.environ.get("PERSONALAI_SEGMENT_MAX_CHARS", 3000))
+TRANSLATION_CONCURRENCY = int(os.environ.get("PERSONALAI_TRANSLATION_CONCURRENCY", 4))
+
+# PDFs are extracted as Markdown from their layout (backend.layout), so the
+# LLM formatting pass is skipped; 0 restores it
+LAYOUT_FORMATTING = os.environ.get("PERSONALAI_LAYOUT_FORMATTING", "1") not in ("", "0")
+
+
+def get_format_chain(**llm_config):
+    return get_chain("format", _build_format_chain, **llm_config)
+
+
+def get_translation_chain(**llm_config):
+    return get_chain("translation", _build_translation_chain, **llm_config)
+
+
+def get_marked_translation_chain(**llm_config):
+    return get_chain("marked_translation", _build_marked_translation_chain, **llm_config)
+
+
+def _build_format_chain(**llm_config):
+    llm = get_llm(**llm_config)
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            (
+                "system",
+                "You are going to recieve a long string text extracted from PDF file. Since it's format got dropped from extraction, I want you to apply format to make it good better.",
+            ),
+            ("user", "{input}"),
+        ]
+    )
+
+    chain = prompt | llm | StrOutputParser()
+    return CachedChain(chain, get_cache_namespace(prompt, llm), get_llm_cache())
+
+
+def _build_translation_chain(**llm_config):
+    llm = get_llm(**llm_config)
+    translation_prompt = ChatPromptTemplate.from_messages(
+        [
+            (
+                "system",
+                "You are tasked with being an excellent English-Korean translator. Your objective is to translate the provided document extracted from a PDF file.",
+            ),
+            (
+                "system",
+                "Present the translation in semantic paragraphs, matching each section of the original text with its corresponding translated segment. Ensure clarity by separating the original text into meaningful units followed by the translation of each respective part",
+            ),
+            ("user", "{input}"),
+        ]
+    )
+
+    chain = translation_prompt | llm | StrOutputParser()
+    return CachedChain(chain, get_cache_namespace(translation_prompt, llm), get_llm_cache())
+
+
+def _build_marked_translation_chain(**llm_config):
+    # several paragraphs in one call, each behind a marker line to split the output by;
+    # every paragraph comes back in the translation chain's original-then-translation form
+    llm = get_llm(**llm_config)
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            (
+                "system",
+                "You are tasked with being an excellent English-Korean translator. Your objective is to translate the provided document extracted from a PDF file.",
+            ),
+            (
+                "system",
+                "Present the translation in semantic paragraphs, matching each section of the original text with its corresponding translated segment. Ensure clarity by separating the original text into meaningful units followed by the translation of each respective part",
+            ),
+            (
+                "system",
+                "The document is given as paragraphs, each after a marker line such as <<1>>. Translate every paragraph in the context of the whole document. Repeat each marker line unchanged on its own line, in the same order, followed by the original paragraph and its translation. Write nothing outside the marked paragraphs.",
+            ),
+            ("system", "{references}"),
+            ("user", "{input}"),
+        ]
+    )
+
+    chain = prompt | llm | StrOutputParser()
+    return CachedChain(chain, get_cache_namespace(prompt, llm), get_llm_cache())
+
+
+def _split_long_block(block: str, max_chars: int) -> list:
+    # a single paragraph that is too long is cut at sentence ends, then at spaces
+    pieces = re.split(r"(?<=[.!?])\s+", block)
+    parts = []
+    for piece in pieces:
+        while len(piece) > max_chars:
+            cut = piece.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            parts.append(piece[:cut])
+            piece = piece[cut:].lstrip()
+        parts.append(piece)
+    return parts
+
+
+def split_segments(text: str, max_chars: int = SEGMENT_MAX_CHARS) -> list:
+    """
+    Splits text into segments of at most max_chars, cutting only between
+    paragraphs (or lines, when the extraction has no blank lines). A longer
+    paragraph is cut at sentence ends, its pieces stay one paragraph within
+    a segment.
+    """
+    separator = "\n\n" if "\n\n" in text else "\n"
+    # (text, joiner to the block before it)
+    blocks = []
+    for block in text.split(separator):
+        if not block.strip():
+            continue
+        if len(block) > max_chars:
+            pieces = _split_long_block(block, max_chars)
+            blocks.append((pieces[0], separator))
+            blocks.extend((piece, " ") for piece in pieces[1:])
+        else:
+            blocks.append((block, separator))
+
+    segments = []
+    current = ""
+    for block, joiner in blocks:
+        if current and len(current) + len(joiner) + len(block) > max_chars:
+            segments.append(current)
+            current = block
+        else:
+            current = f"{current}{joiner}{block}" if current else block
+    if current:
+        segments.append(current)
+    return segments
+
+
+_MARKER_LINE = re.compile(r"<<(\d+)>>[ \t]*")
+_MARKER = re.compile(r"^<<(\d+)>>[ \t]*$", re.MULTILINE)
+# the start of a line that may still turn out to be a marker
+_MARKER_PREFIX = re.compile(r"<{0,2}|<<\d+>{0,2}[ \t]*")
+
+
+def _units(segment: str) -> list:
+    # paragraphs are the translation memory's unit, text without blank lines stays whole
+    return segment.split("\n\n") if "\n\n" in segment else [segment]
+
+
+def _mark(paragraphs: list) -> str:
+    return "\n\n".join(f"<<{number}>>\n{paragraph}" for number, paragraph in enumerate(paragraphs, 1))
+
+
+def parse_marked(text: str, paragraphs: int):
+    """
+    The paragraph translations in output of the marked prompt, or None
+    unless every marker came back once and in order.
+    """
+    parts = _MARKER.split(text)
+    if parts[1::2] != [str(number) for number in range(1, paragraphs + 1)]:
+        return None
+    return [part.strip() for part in parts[2::2]]
+
+
+class _MarkedStream:
+    """
+    Turns streamed output of the marked prompt into the streamed segment
+    translation: marker lines are dropped, and the paragraphs taken from
+    the translation memory are put back in place. units holds the
+    remembered translation of each paragraph, None for those in the output.
+    """
+
+    def __init__(self, units: list, emit):
+        self.units = units
+        self.emit = emit
+        self.misses = [position for position, unit in enumerate(units) if unit is None]
+        self.next_unit = 0
+        self.line = ""
+        self.passing = False
+        self.started = False
+        self.unit_start = False
+        self.pending = ""
+
+    def _separate(self):
+        if self.next_unit:
+            self.emit("\n\n")
+
+    def _emit_until(self, stop: int):
+        while self.next_unit < stop:
+            self._separate()
+            self.emit(self.units[self.next_unit])
+            self.next_unit += 1
+
+    def open(self, number: int):
+        # the paragraph behind marker number starts
+        if not 0 < number <= len(self.misses) or self.misses[number - 1] < self.next_unit:
+            return
+        position = self.misses[number - 1]
+        self._emit_until(position)
+        self._separate()
+        self.next_unit = position + 1
+        self.started = self.unit_start = True
+        self.pending = ""
+
+    def _text(self, text: str):
+        # surrounding whitespace of a paragraph is dropped, as by parse_marked
+        if not self.started:
+            return
+        if self.unit_start:
+            text = text.lstrip()
+            if not text:
+                return
+            self.unit_start = False
+        core = text.rstrip()
+        if core:
+            self.emit(self.pending + core)
+            self.pending = text[len(core):]
+        else:
+            self.pending += text
+
+    def feed(self, token: str):
+        for piece in re.split(r"(?<=\n)", token):
+            if not piece:
+                continue
+            if self.passing:
+                self._text(piece)
+            else:
+                self.line += piece
+                if self.line.endswith("\n"):
+                    self._end_line()
+                elif not _MARKER_PREFIX.fullmatch(self.line):
+                    self._text(self.line)
+                    self.line = ""
+                    self.passing = True
+            if piece.endswith("\n"):
+                self.passing = False
+
+    def _end_line(self):
+        marker = _MARKER_LINE.fullmatch(self.line.rstrip("\n"))
+        if marker:
+            self.open(int(marker.group(1)))
+        else:
+            self._text(self.line)
+        self.line = ""
+
+    def close(self):
+        if self.line:
+            self._end_line()
+        self._emit_until(len(self.units))
+
+
+def _describe_references(references: dict) -> str:
+    if not references:
+        return "There are no earlier translations to refer to."
+    parts = [
+        "Earlier translations of similar paragraphs follow. Reuse their wording where the "
+        "meaning is the same, but translate every difference (negations, parties, numbers) "
+        "from the paragraph itself."
+    ]
+    for number, (source, target) in references.items():
+        parts.append(f"Paragraph {number} is similar to:\n{source}\nwhich was translated as:\n{target}")
+    return "\n\n".join(parts)
+
+
+async def _complete(chain, inputs: dict, semaphore, on_token=None) -> str:
+    async with semaphore:
+        if on_token is None:
+            return await chain.ainvoke(inputs)
+        tokens = []
+        async for token in chain.astream(inputs):
+            tokens.append(token)
+            on_token(token)
+        return "".join(tokens)
+
+
+def _recall(memory, namespace: str, units: list):
+    # (remembered translation or None per paragraph, references of the others by number)
+    found = [unit if not unit.strip() else memory.lookup(namespace, unit) for unit in units]
+    missing = [unit for unit, translated in zip(units, found) if translated is None]
+    references = {}
+    for number, unit in enumerate(missing, 1):
+        reference = memory.similar(namespace, unit)
+        if reference is not None:
+            references[number] = reference
+    return found, references
+
+
+async def _translate(segment: str, semaphore, on_token=None) -> str:
+    """
+    Translates segment. With the translation memory on, paragraphs stored in
+    it are reused and the others are translated in one marked call, with
+    similar stored paragraphs as references, then stored.
+    on_token(token) receives the translation as it is produced; a None
+    token drops the ones before it, the segment is being translated again.
+    """
+    chain = get_translation_chain()
+    if not TRANSLATION_MEMORY:
+        return await _complete(chain, {"input": segment}, semaphore, on_token)
+
+    # the memory holds outputs of the marked prompt only, under its own namespace
+    marked_chain = get_marked_translation_chain()
+    memory = get_translation_memory()
+    units = _units(segment)
+    # SQLite lookups stay off the event loop shared by every session
+    found, references = await asyncio.to_thread(_recall, memory, marked_chain.namespace, units)
+    missing = [unit for unit, translated in zip(units, found) if translated is None]
+    stream = _MarkedStream(list(found), on_token) if on_token is not None else None
+
+    translations = []
+    if missing:
+        inputs = {"input": _mark(missing), "references": _describe_references(references)}
+        output = await _complete(marked_chain, inputs, semaphore, stream and stream.feed)
+        translations = parse_marked(output, len(missing))
+        if translations is None:
+            # markers lost: the segment is translated whole and not remembered
+            count("tm_marker_mismatches")
+            if on_token is not None:
+                on_token(None)
+            return await _complete(chain, {"input": segment}, semaphore, on_token)
+    if stream is not None:
+        stream.close()
+
+    translated = iter(translations)
+    found = [next(translated) if unit is None else unit for unit in found]
+    await asyncio.to_thread(memory.add_many, marked_chain.namespace, list(zip(missing, translations)))
+    return "\n\n".join(found)
+
+
+async def _schedule(segments, run):
+    # pull from the iterable in a thread so parsing does not block the loop
+    iterator = iter(segments)
+    tasks = []
+    try:
+        while True:
+            segment = await asyncio.to_thread(next, iterator, None)
+            if segment is None:
+                break
+            tasks.append(asyncio.create_task(run(len(tasks), segment)))
+
+        return await asyncio.gather(*tasks)
+    finally:
+        # on cancellation or error, segments still running are stopped too
+        for task in tasks:
+            task.cancel()
+
+
+async def translate_segments(segments, concurrency: int = TRANSLATION_CONCURRENCY, on_segment=None,
+                             llm_format: bool = not LAYOUT_FORMATTING, semaphore=None, on_token=None):
+    """
+    Formats (when llm_format is set) then translates every segment, with at
+    most `concurrency` segments talking to the LLM at a time. Passing a
+    shared asyncio.Semaphore instead bounds several documents together.
+    segments may be a lazy iterable (e.g. fed by a PDF that is still being
+    parsed); segments start translating as soon as they are produced.
+    on_segment(index, parsed, translated) is called as each segment finishes
+    and on_token(index, token) with each translated token on the way (a None
+    token drops the segment's tokens so far, it is translated again).
+    Returns (parsed_segments, translated_segments) in the original order.
+    """
+    format_chain = get_format_chain()
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index, segment):
+        parsed = segment
+        if llm_format:
+            async with semaphore:
+                with trace_span("format_segment"):
+                    parsed = await format_chain.ainvoke({"input": segment})
+        with trace_span("translate_segment"):
+            translated = await _translate(
+                parsed, semaphore, on_token and (lambda token: on_token(index, token))
+            )
+        if on_segment is not None:
+            on_segment(index, parsed, translated)
+        return parsed, translated
+
+    results = await _schedule(segments, run)
+    parsed_segments = [parsed for parsed, _ in results]
+    translated_segments = [translated for _, translated in results]
+    return parsed_segments, translated_segments
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from backend.config import cache_path
+from backend.tracing import count
+
+# Translation memory is on unless PERSONALAI_TRANSLATION_MEMORY=0
+TRANSLATION_MEMORY = os.environ.get("PERSONALAI_TRANSLATION_MEMORY", "1") not in ("", "0")
+
+# Character trigram similarity above which a stored paragraph is shown to
+# the LLM as a reference; only identical paragraphs reuse a translation
+TM_FUZZY_THRESHOLD = float(os.environ.get("PERSONALAI_TM_FUZZY_THRESHOLD", 0.85))
+
+# Stored paragraphs compared in full for each fuzzy lookup
+_FUZZY_CANDIDATES = 5
+
+# Word bigrams in more stored paragraphs than this ("of the") stop being
+# indexed and are skipped by lookups, so a lookup never scans most of the memory
+_MAX_GRAM_UNITS = 100
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+
+
+def _index_grams(text: str) -> set:
+    # word bigrams find the candidates, one word paragraphs use the word
+    words = normalize(text).lower().split()
+    if len(words) < 2:
+        return set(words)
+    return {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+def _trigrams(text: str) -> set:
+    text = normalize(text).lower()
+    return {text[i : i + 3] for i in range(max(len(text) - 2, 1))}
+
+
+def similarity(first: str, second: str) -> float:
+    # Dice coefficient over character trigrams
+    a, b = _trigrams(first), _trigrams(second)
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+class TranslationMemory:
+    """
+    Persistent source paragraph -> translation pairs, shared by every
+    document and session. lookup() reuses the translation of a paragraph
+    whose whitespace-normalized text is identical. similar() finds a
+    near-identical stored paragraph, meant as a reference for the LLM only:
+    "shall not be liable" and "shall be liable" are near-identical too.
+    Pairs are kept per namespace, e.g. the translation prompt and model.
+    Calls block on SQLite, async code runs them in a thread.
+    """
+
+    def __init__(self, path: str, threshold: float = TM_FUZZY_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS units ("
+            "namespace TEXT NOT NULL, hash TEXT NOT NULL, source TEXT NOT NULL,"
+            " target TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (namespace, hash))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS grams ("
+            "namespace TEXT NOT NULL, gram TEXT NOT NULL, hash TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS grams_lookup ON grams (namespace, gram)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS gram_counts ("
+            "namespace TEXT NOT NULL, gram TEXT NOT NULL, units INTEGER NOT NULL,"
+            " PRIMARY KEY (namespace, gram))"
+        )
+        self._conn.commit()
+
+    def _gram_counts(self, namespace: str, grams: list) -> dict:
+        counts = {}
+        # stay below SQLite's host parameter limit
+        for start in range(0, len(grams), 500):
+            batch = grams[start : start + 500]
+            counts.update(
+                self._conn.execute(
+                    f"SELECT gram, units FROM gram_counts WHERE namespace = ?"
+                    f" AND gram IN ({','.join('?' * len(batch))})",
+                    [namespace, *batch],
+                )
+            )
+        return counts
+
+    def lookup(self, namespace: str, source: str):
+        """
+        The stored translation of source, otherwise None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT target FROM units WHERE namespace = ? AND hash = ?",
+                (namespace, _hash(source)),
+            ).fetchone()
+        count("tm_exact_hits" if row is not None else "tm_misses")
+        return row[0] if row is not None else None
+
+    def similar(self, namespace: str, source: str):
+        """
+        (stored source, translation) of the most similar stored paragraph at
+        or above threshold, otherwise None.
+        """
+        with self._lock:
+            counts = self._gram_counts(namespace, list(_index_grams(source)))
+            grams = [gram for gram, units in counts.items() if units <= _MAX_GRAM_UNITS]
+
+            shared = {}
+            for start in range(0, len(grams), 500):
+                batch = grams[start : start + 500]
+                rows = self._conn.execute(
+                    f"SELECT hash, COUNT(*) FROM grams WHERE namespace = ?"
+                    f" AND gram IN ({','.join('?' * len(batch))}) GROUP BY hash",
+                    [namespace, *batch],
+                ).fetchall()
+                for hash_, matches in rows:
+                    shared[hash_] = shared.get(hash_, 0) + matches
+
+            best, best_score = None, self.threshold
+            for hash_ in sorted(shared, key=shared.get, reverse=True)[:_FUZZY_CANDIDATES]:
+                stored, target = self._conn.execute(
+                    "SELECT source, target FROM units WHERE namespace = ? AND hash = ?",
+                    (namespace, hash_),
+                ).fetchone()
+                score = similarity(source, stored)
+                if score >= best_score:
+                    best, best_score = (stored, target), score
+        if best is not None:
+            count("tm_references")
+        return best
+
+    def add_many(self, namespace: str, pairs: list):
+        """
+        Stores (source, translation) pairs; sources already stored are kept.
+        """
+        now = time.time()
+        with self._lock:
+            for source, target in pairs:
+                hash_ = _hash(source)
+                inserted = self._conn.execute(
+                    "INSERT OR IGNORE INTO units (namespace, hash, source, target, created)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (namespace, hash_, source, target, now),
+                ).rowcount
+                if not inserted:
+                    continue
+
+                grams = list(_index_grams(source))
+                self._conn.executemany(
+                    "INSERT INTO gram_counts (namespace, gram, units) VALUES (?, ?, 1)"
+                    " ON CONFLICT (namespace, gram) DO UPDATE SET units = units + 1",
+                    [(namespace, gram) for gram in grams],
+                )
+                counts = self._gram_counts(namespace, grams)
+                self._conn.executemany(
+                    "INSERT INTO grams (namespace, gram, hash) VALUES (?, ?, ?)",
+                    [(namespace, gram, hash_) for gram in grams if counts[gram] <= _MAX_GRAM_UNITS],
+                )
+            self._conn.commit()
+
+    def add(self, namespace: str, source: str, target: str):
+        self.add_many(namespace, [(source, target)])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM units").fetchone()[0]
+
+
+_memory = None
+
+
+def get_translation_memory() -> TranslationMemory:
+    global _memory
+    if _memory is None:
+        _memory = TranslationMemory(cache_path("translation_memory.sqlite3"))
+    return _memory
@@ -0,0 +1,142 @@
+import math
+import os
+
+import faiss
+import numpy as np
+
+# How the FAISS vectors are stored:
+#   flat  exact search over float32 vectors (what FAISS.from_texts builds)
+#   fp16  exact search over float16 vectors, half the memory
+#   ivf   inverted lists over 8-bit vectors, 4x less memory, only nprobe lists are scanned
+#   pq    inverted lists over product-quantized vectors, 16x less memory, lower recall
+INDEX_MODES = ("flat", "fp16", "ivf", "pq")
+INDEX_MODE = os.environ.get("PERSONALAI_INDEX_MODE", "flat")
+
+# ivf and pq are trained on the vectors themselves, smaller stores stay flat
+INDEX_TRAIN_MIN = int(os.environ.get("PERSONALAI_INDEX_TRAIN_MIN", "4096"))
+
+# Inverted lists scanned per query, the recall/latency knob of ivf and pq
+INDEX_NPROBE = int(os.environ.get("PERSONALAI_INDEX_NPROBE", "8"))
+
+
+def _pq_subquantizers(dim: int) -> int:
+    # one byte per 4 dimensions when the dimension allows it, coarser codes lose too much recall
+    for width in (4, 2, 1):
+        if dim % width == 0:
+            return dim // width
+
+
+def get_index_factory(mode: str, dim: int, count: int) -> str:
+    if mode == "fp16":
+        return "SQfp16"
+    nlist = max(1, int(math.sqrt(count)))
+    if mode == "ivf":
+        return f"IVF{nlist},SQ8"
+    if mode == "pq":
+        return f"IVF{nlist},PQ{_pq_subquantizers(dim)}x8"
+    raise ValueError(f"Unknown index mode {mode!r}, expected one of {INDEX_MODES}")
+
+
+def needs_training(mode: str) -> bool:
+    return mode in ("ivf", "pq")
+
+
+def build_index(vectors: np.ndarray, mode: str, metric: int = faiss.METRIC_L2):
+    """
+    Trains an index of the given mode on vectors and adds them, in order.
+    Returns None when there are too few vectors to train it.
+    """
+    if mode == "flat":
+        index = faiss.IndexFlat(vectors.shape[1], metric)
+        index.add(vectors)
+        return index
+    if needs_training(mode) and len(vectors) < INDEX_TRAIN_MIN:
+        return None
+
+    count, dim = vectors.shape
+    index = faiss.index_factory(dim, get_index_factory(mode, dim, count), metric)
+    index.train(vectors)
+    index.add(vectors)
+    if needs_training(mode):
+        faiss.extract_index_ivf(index).nprobe = INDEX_NPROBE
+    return index
+
+
+def compress_vectorstore(vector_store, mode: str = INDEX_MODE):
+    """
+    Swaps the flat index of a FAISS store for one of the given mode, keeping
+    the docstore and ids. A store that is already compressed, or too small to
+    train, is left as is.
+    """
+    index = vector_store.index
+    if mode == "flat" or not isinstance(index, faiss.IndexFlat) or index.ntotal == 0:
+        return vector_store
+
+    compressed = build_index(index.reconstruct_n(0, index.ntotal), mode, index.metric_type)
+    if compressed is not None:
+        vector_store.index = compressed
+    return vector_store
+
+
+def _rebuild_invlists(ivf, removed: np.ndarray):
+    """
+    Copies the inverted lists of ivf without the removed ids, shifting every
+    other id down by the number of removed ids below it. The lists of an
+    mmap-loaded index are read-only, so they are replaced, not edited.
+    """
+    invlists = ivf.invlists
+    code_size = invlists.code_size
+    rebuilt = faiss.ArrayInvertedLists(invlists.nlist, code_size)
+    for list_no in range(invlists.nlist):
+        size = invlists.list_size(list_no)
+        if not size:
+            continue
+        ids_ptr = invlists.get_ids(list_no)
+        codes_ptr = invlists.get_codes(list_no)
+        list_ids = faiss.rev_swig_ptr(ids_ptr, size).copy()
+        codes = faiss.rev_swig_ptr(codes_ptr, size * code_size).copy().reshape(size, code_size)
+        invlists.release_ids(list_no, ids_ptr)
+        invlists.release_codes(list_no, codes_ptr)
+
+        keep = ~np.isin(list_ids, removed)
+        kept_ids = np.ascontiguousarray(list_ids[keep] - np.searchsorted(removed, list_ids[keep]))
+        kept_codes = np.ascontiguousarray(codes[keep])
+        if len(kept_ids):
+            rebuilt.add_entries(list_no, len(kept_ids), faiss.swig_ptr(kept_ids), faiss.swig_ptr(kept_codes))
+
+    # the index owns the new lists, Python must not free them
+    ivf.replace_invlists(rebuilt, True)
+    rebuilt.this.disown()
+    ivf.ntotal -= len(removed)
+    if ivf.direct_map.type != faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+
+
+def delete_vectors(vector_store, ids: list):
+    """
+    FAISS.delete, also for ivf and pq stores. Their ids are not renumbered
+    by remove_ids, while the store expects them to stay 0..n-1.
+    """
+    try:
+        ivf = faiss.extract_index_ivf(vector_store.index)
+    except RuntimeError:
+        return vector_store.delete(ids)
+
+    wanted = set(ids)
+    missing_ids = wanted.difference(vector_store.index_to_docstore_id.values())
+    if missing_ids:
+        raise ValueError(f"Some specified ids do not exist in the current store. Ids not found: {missing_ids}")
+
+    removed = np.array(
+        sorted(i for i, id_ in vector_store.index_to_docstore_id.items() if id_ in wanted),
+        dtype=np.int64,
+    )
+    _rebuild_invlists(ivf, removed)
+    if vector_store.index is not ivf:
+        vector_store.index.ntotal = ivf.ntotal
+
+    # the bookkeeping of FAISS.delete
+    vector_store.docstore.delete(ids)
+    remaining = [id_ for _, id_ in sorted(vector_store.index_to_docstore_id.items()) if id_ not in wanted]
+    vector_store.index_to_docstore_id = dict(enumerate(remaining))
+    return True
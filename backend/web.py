@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+from dataclasses import dataclass
+
+import httpx
+from bs4 import BeautifulSoup
+
+from backend.config import cache_path
+from backend.tracing import count
+
+# Connection limits of the shared HTTP client
+FETCH_MAX_CONNECTIONS = int(os.environ.get("PERSONALAI_FETCH_MAX_CONNECTIONS", 32))
+FETCH_PER_HOST = int(os.environ.get("PERSONALAI_FETCH_PER_HOST", 4))
+FETCH_TIMEOUT = float(os.environ.get("PERSONALAI_FETCH_TIMEOUT", 30))
+
+
+@dataclass
+class WebPage:
+    url: str
+    text: str = ""
+    content_hash: str = None
+    # False when the server (304) or the content hash says nothing changed
+    changed: bool = True
+    status: int = None
+    error: str = None
+
+
+class HttpCache:
+    """
+    Last response of every URL on disk: its body plus the validators
+    (ETag / Last-Modified) sent back on the next request.
+    """
+
+    def _paths(self, url: str):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return cache_path("http", f"{key}.json"), cache_path("http", f"{key}.body")
+
+    def get(self, url: str):
+        meta_path, body_path = self._paths(url)
+        if not os.path.exists(meta_path) or not os.path.exists(body_path):
+            return None, None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(body_path, "rb") as f:
+            return meta, f.read()
+
+    def set(self, url: str, meta: dict, body: bytes):
+        meta_path, body_path = self._paths(url)
+        # body first: a reader never sees validators for a body it cannot load
+        for path, data in ((body_path, body), (meta_path, json.dumps(meta).encode("utf-8"))):
+            # unique per write, the same URL may be fetched twice at once
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+
+def html_to_text(html: bytes) -> str:
+    # same extraction as WebBaseLoader
+    return BeautifulSoup(html, "html.parser").get_text()
+
+
+async def _fetch(client, url: str, cache: HttpCache, host_limits: dict) -> WebPage:
+    meta, body = cache.get(url)
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    host = httpx.URL(url).host
+    async with host_limits.setdefault(host, asyncio.Semaphore(FETCH_PER_HOST)):
+        try:
+            response = await client.get(url, headers=headers)
+        except httpx.HTTPError as error:
+            if body is None:
+                return WebPage(url, error=repr(error))
+            # serve the last good copy while the site is unreachable
+            return WebPage(url, html_to_text(body), meta["content_hash"], False, error=repr(error))
+
+    if response.status_code == 304 and body is not None:
+        count("http_not_modified")
+        return WebPage(url, html_to_text(body), meta["content_hash"], False, 304)
+    if response.status_code >= 400:
+        return WebPage(url, status=response.status_code, error=response.reason_phrase)
+
+    content = response.content
+    content_hash = hashlib.sha256(content).hexdigest()
+    changed = meta is None or meta.get("content_hash") != content_hash
+    cache.set(
+        url,
+        {
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "content_hash": content_hash,
+        },
+        content,
+    )
+    return WebPage(url, html_to_text(content), content_hash, changed, response.status_code)
+
+
+async def fetch_pages(urls: list, cache: HttpCache = None) -> list:
+    """
+    Fetches all urls concurrently over one pooled client, at most
+    FETCH_PER_HOST requests per host at a time. Returns WebPages in order.
+    """
+    cache = cache or HttpCache()
+    host_limits = {}
+    limits = httpx.Limits(
+        max_connections=FETCH_MAX_CONNECTIONS, max_keepalive_connections=FETCH_MAX_CONNECTIONS
+    )
+    async with httpx.AsyncClient(
+        limits=limits, timeout=FETCH_TIMEOUT, follow_redirects=True
+    ) as client:
+        return await asyncio.gather(*(_fetch(client, url, cache, host_limits) for url in urls))
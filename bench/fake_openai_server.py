@@ -0,0 +1,147 @@
+"""
+Local stand-in for the OpenAI embeddings endpoint that throttles like the
+real one: requests over the requests-per-minute or tokens-per-minute budget
+get a 429 with a Retry-After header.
+
+    python -m bench.fake_openai_server --port 8765 --rpm 60 --tpm 20000
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Throttle:
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, window: float = 60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self.calls = deque()
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+
+    def admit(self, tokens: int):
+        """
+        Returns None when the request fits the budgets, otherwise the number
+        of seconds until it would.
+        """
+        with self.lock:
+            now = time.monotonic()
+            while self.calls and self.calls[0][0] <= now - self.window:
+                self.calls.popleft()
+
+            used_tokens = sum(call_tokens for _, call_tokens in self.calls)
+            if (
+                len(self.calls) >= self.requests_per_minute
+                or used_tokens + tokens > self.tokens_per_minute
+            ):
+                self.rejected += 1
+                oldest = self.calls[0][0] if self.calls else now
+                return max(0.05, oldest + self.window - now)
+
+            self.calls.append((now, tokens))
+            self.accepted += 1
+            return None
+
+
+def _vector(item, dimensions: int) -> list:
+    seed = int.from_bytes(hashlib.sha256(json.dumps(item).encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = sum(value * value for value in vector) ** 0.5
+    return [value / norm for value in vector]
+
+
+def make_handler(throttle: Throttle, dimensions: int, latency: float):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: dict, headers: dict = None):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            if not self.path.endswith("/embeddings"):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            inputs = request["input"]
+            inputs = inputs if isinstance(inputs, list) else [inputs]
+            tokens = sum(len(item) if isinstance(item, list) else len(item) // 4 + 1 for item in inputs)
+
+            wait = throttle.admit(tokens)
+            if wait is not None:
+                self._send(
+                    429,
+                    {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                    {"Retry-After": f"{wait:.2f}"},
+                )
+                return
+
+            time.sleep(latency)
+            data = []
+            for index, item in enumerate(inputs):
+                vector = _vector(item, dimensions)
+                if request.get("encoding_format") == "base64":
+                    vector = base64.b64encode(struct.pack(f"<{dimensions}f", *vector)).decode("ascii")
+                data.append({"object": "embedding", "index": index, "embedding": vector})
+
+            self._send(
+                200,
+                {
+                    "object": "list",
+                    "data": data,
+                    "model": request.get("model", "fake"),
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                },
+            )
+
+    return Handler
+
+
+def start_server(port: int = 0, requests_per_minute: int = 60, tokens_per_minute: int = 100_000,
+                 dimensions: int = 64, latency: float = 0.0, window: float = 60.0):
+    """
+    Starts the server in a daemon thread, returns (server, throttle).
+    The base URL is f"http://127.0.0.1:{server.server_port}/v1".
+    """
+    throttle = Throttle(requests_per_minute, tokens_per_minute, window)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(throttle, dimensions, latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, throttle
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rpm", type=int, default=60)
+    parser.add_argument("--tpm", type=int, default=100_000)
+    parser.add_argument("--dimensions", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, _ = start_server(args.port, args.rpm, args.tpm, args.dimensions, args.latency)
+    print(f"listening on http://127.0.0.1:{server.server_port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
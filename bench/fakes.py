@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import random
+import time
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from backend import registry
+
+
+class FakeChatOpenAI(BaseChatModel):
+    """
+    Stand-in for ChatOpenAI: answers with the last message echoed back, after
+    `latency` seconds for the first token and `token_latency` per word.
+    """
+
+    model_name: str = "fake-chat"
+    temperature: float = 0.7
+    latency: float = 0.0
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _tokens(self, messages):
+        words = messages[-1].content.split(" ")
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        time.sleep(self.latency + self.token_latency * len(tokens))
+        message = AIMessage(content="".join(tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.latency + self.token_latency * len(tokens))
+        message = AIMessage(content="".join(tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for token in self._tokens(messages):
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for token in self._tokens(messages):
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class FakeOpenAIEmbeddings(Embeddings):
+    """
+    Stand-in for OpenAIEmbeddings: unit vectors seeded by the text hash, so the
+    same text always gets the same vector. Every request (up to chunk_size
+    texts) sleeps `latency` seconds.
+    """
+
+    def __init__(self, dimensions: int = 1536, latency: float = 0.0, chunk_size: int = 1000,
+                 max_retries: int = 2):
+        self.model = f"fake-embedding-{dimensions}"
+        self.max_retries = max_retries
+        self.dimensions = dimensions
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.requests = 0
+
+    def _vector(self, text: str) -> list:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        rng = random.Random(seed)
+        vector = [rng.gauss(0.0, 1.0) for _ in range(self.dimensions)]
+        norm = sum(value * value for value in vector) ** 0.5
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: list) -> list:
+        for start in range(0, len(texts), self.chunk_size):
+            self.requests += 1
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        self.requests += 1
+        time.sleep(self.latency)
+        return self._vector(text)
+
+
+def install_fakes(llm_latency: float = 0.0, token_latency: float = 0.0,
+                  embedding_latency: float = 0.0, dimensions: int = 1536):
+    """
+    Makes the backend build fake clients instead of OpenAI ones, and drops
+    every client and chain built before.
+    """
+
+    def chat(**config):
+        return FakeChatOpenAI(latency=llm_latency, token_latency=token_latency, **config)
+
+    def embeddings(**config):
+        return FakeOpenAIEmbeddings(dimensions=dimensions, latency=embedding_latency, **config)
+
+    registry.ChatOpenAI = chat
+    registry.OpenAIEmbeddings = embeddings
+    with registry._lock:
+        registry._clients.clear()
+        registry._chains.clear()
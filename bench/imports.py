@@ -0,0 +1,68 @@
+"""
+Import-time profile of the app: what the first page render pays for, and
+what each mode pulls in on first use. Every entry point is imported in a
+fresh interpreter with -X importtime.
+
+    python -m bench.imports --top 15
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# (label, modules imported together), each in a clean process
+ENTRY_POINTS = [
+    ("first page", ["streamlit", "backend.lazy", "backend.tracing"]),
+    ("translation mode", ["backend.jobs"]),
+    ("chatbot mode", ["langchain_core.messages", "backend.backend"]),
+]
+
+
+def profile(modules: list) -> list:
+    """
+    Returns (module, self_us, cumulative_us) rows in import order.
+    """
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "profile")}
+    code = "; ".join(f"import {module}" for module in modules)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def _depth(name: str) -> int:
+    # -X importtime indents nested imports by two spaces per level
+    return (len(name) - len(name.lstrip()) - 1) // 2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=10, help="slowest top-level imports to list")
+    args = parser.parse_args(argv)
+
+    baseline, first_page = None, set()
+    for label, modules in ENTRY_POINTS:
+        rows = profile(modules if baseline is None else ENTRY_POINTS[0][1] + modules)
+        total = sum(self_us for _, self_us, _ in rows)
+        if baseline is None:
+            baseline, first_page = total, {name.strip() for name, _, _ in rows}
+            print(f"{label:<18}{total / 1e6:>8.3f}s")
+        else:
+            print(f"{label:<18}{(total - baseline) / 1e6:>8.3f}s on top of the first page")
+            rows = [row for row in rows if row[0].strip() not in first_page]
+
+        # what the entry modules import directly, by cumulative time
+        children = [row for row in rows if _depth(row[0]) == 1]
+        for name, _, cumulative_us in sorted(children, key=lambda row: -row[2])[:args.top]:
+            print(f"    {cumulative_us / 1e6:>8.3f}s {name.strip()}")
+
+
+if __name__ == "__main__":
+    main()
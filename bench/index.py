@@ -0,0 +1,95 @@
+"""
+Recall and latency of the compressed index modes against the exact flat
+index, on clustered random vectors shaped like text embeddings.
+
+    python -m bench.index --vectors 20000 80000 --dim 1536 --nprobe 4 8 16
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from backend import vector_index
+from backend.vector_index import INDEX_MODES, build_index
+
+
+def make_vectors(count: int, dim: int, clusters: int, seed: int, rank: int = 64) -> np.ndarray:
+    # embeddings of real text are clustered by topic and have a low intrinsic dimension
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, rank)).astype("float32")
+    latent = centers[rng.integers(clusters, size=count)]
+    latent += 0.7 * rng.standard_normal((count, rank)).astype("float32")
+    vectors = latent @ rng.standard_normal((rank, dim)).astype("float32")
+    vectors += 2.4 * rng.standard_normal((count, dim)).astype("float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def recall_at_k(found: np.ndarray, expected: np.ndarray) -> float:
+    hits = sum(len(set(row) & set(truth)) for row, truth in zip(found, expected))
+    return hits / expected.size
+
+
+def measure(index, queries: np.ndarray, k: int):
+    # one query at a time, like the chatbot does
+    start = time.perf_counter()
+    found = np.vstack([index.search(query[None, :], k)[1] for query in queries])
+    return found, (time.perf_counter() - start) / len(queries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, nargs="+", default=[20_000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[vector_index.INDEX_NPROBE])
+    parser.add_argument("--modes", nargs="+", default=list(INDEX_MODES), choices=INDEX_MODES)
+    parser.add_argument("--json", help="write the rows to this file")
+    args = parser.parse_args(argv)
+
+    rows = []
+    for count in args.vectors:
+        vectors = make_vectors(count + args.queries, args.dim, args.clusters, seed=count)
+        vectors, queries = vectors[:count], vectors[count:]
+        exact, _ = measure(build_index(vectors, "flat"), queries, args.k)
+
+        for mode in args.modes:
+            start = time.perf_counter()
+            index = build_index(vectors, mode)
+            build_seconds = time.perf_counter() - start
+            if index is None:
+                print(f"{mode:<6}{count:>8} vectors: too few to train, stays flat")
+                continue
+
+            size = len(faiss.serialize_index(index))
+            for nprobe in args.nprobe if vector_index.needs_training(mode) else [None]:
+                if nprobe is not None:
+                    faiss.extract_index_ivf(index).nprobe = nprobe
+                found, latency = measure(index, queries, args.k)
+                row = {
+                    "mode": mode,
+                    "vectors": count,
+                    "nprobe": nprobe,
+                    "index_mb": round(size / 2**20, 2),
+                    "build_seconds": round(build_seconds, 3),
+                    "query_ms": round(latency * 1000, 3),
+                    f"recall@{args.k}": round(recall_at_k(found, exact), 4),
+                }
+                rows.append(row)
+                print(
+                    f"{mode:<6}{count:>8} vectors  nprobe {nprobe or '-':>4} "
+                    f"{row['index_mb']:>9.1f} MB {row['query_ms']:>8.3f} ms/query "
+                    f"recall@{args.k} {row[f'recall@{args.k}']:.3f}"
+                )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Ingests generated web pages from a local HTTP server that supports ETag
+and Last-Modified, twice, and reports what was fetched and re-embedded.
+
+    python -m bench.ingest --pages 50 --change 5
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("PERSONALAI_CACHE_DIR", tempfile.mkdtemp(prefix="personalai-bench-"))
+
+from backend.backend import ingest_urls
+from backend.embeddings import load_embedding_engine
+from bench.fakes import install_fakes
+from bench.pdfgen import make_text_lines
+
+
+class Site:
+    def __init__(self, pages: int, latency: float):
+        self.versions = [0] * pages
+        self.latency = latency
+        self.requests = 0
+        self.not_modified = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def body(self, number: int) -> bytes:
+        lines = make_text_lines(number, 30, seed=self.versions[number])
+        return ("<html><body>" + "".join(f"<p>{line}</p>" for line in lines) + "</body></html>").encode()
+
+
+def make_handler(site: Site):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            with site.lock:
+                site.requests += 1
+                site.in_flight += 1
+                site.max_in_flight = max(site.max_in_flight, site.in_flight)
+            try:
+                time.sleep(site.latency)
+                number = int(self.path.strip("/").split("/")[-1])
+                body = site.body(number)
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()
+                if self.headers.get("If-None-Match") == etag:
+                    with site.lock:
+                        site.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", formatdate(usegmt=True))
+                self.end_headers()
+                self.wfile.write(body)
+            finally:
+                with site.lock:
+                    site.in_flight -= 1
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--change", type=int, default=5, help="pages modified before the second run")
+    parser.add_argument("--latency", type=float, default=0.05, help="server seconds per request")
+    args = parser.parse_args(argv)
+
+    install_fakes()
+    embeddings = load_embedding_engine()
+
+    site = Site(args.pages, args.latency)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(site))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [f"http://127.0.0.1:{server.server_port}/page/{i}" for i in range(args.pages)]
+
+    corpus = None
+    for run in range(2):
+        if run:
+            for number in range(args.change):
+                site.versions[number] += 1
+
+        requests, not_modified, embed_calls = site.requests, site.not_modified, embeddings.requests
+        start = time.perf_counter()
+        corpus, pages = ingest_urls(urls, corpus)
+        seconds = time.perf_counter() - start
+
+        print(
+            f"run {run + 1}: {seconds:.2f}s, {site.requests - requests} requests, "
+            f"{site.not_modified - not_modified} not modified, "
+            f"{sum(page.changed for page in pages)} changed pages, "
+            f"{embeddings.requests - embed_calls} embedding requests, "
+            f"max {site.max_in_flight} in flight, {corpus.vector_store.index.ntotal} chunks"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import random
+
+# Vocabulary for generated documents, with a few ids so keyword lookups
+# have something to find
+_WORDS = (
+    "the contract agreement party shall provide service within days notice "
+    "payment invoice delivery warranty clause section term period liability "
+    "customer supplier product report quarterly revenue growth market risk "
+    "data model system performance latency throughput memory index query"
+).split()
+
+
+def make_text_lines(page_number: int, lines: int, seed: int = 0) -> list:
+    rng = random.Random(seed * 100_003 + page_number)
+    text_lines = [f"Section {page_number + 1}. Part number PN-{page_number:05d}"]
+    for _ in range(lines - 1):
+        text_lines.append(" ".join(rng.choice(_WORDS) for _ in range(rng.randint(8, 14))))
+    return text_lines
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: int, lines_per_page: int = 45, seed: int = 0) -> bytes:
+    """
+    Builds a plain text PDF (Helvetica, one column) with a real text layer,
+    deterministic for a given (pages, lines_per_page, seed).
+    """
+    streams = []
+    for page_number in range(pages):
+        content = ["BT", "/F1 10 Tf", "12 TL", "50 780 Td"]
+        for line in make_text_lines(page_number, lines_per_page, seed):
+            content.append(f"({_escape(line)}) Tj T*")
+        content.append("ET")
+        streams.append("\n".join(content))
+    return _write_pdf(streams)
+
+
+def _wrap(rng: random.Random, words: int, chars_per_line: int) -> list:
+    text = " ".join(rng.choice(_WORDS) for _ in range(words)) + "."
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > chars_per_line:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    return lines + [line]
+
+
+def make_layout_pdf(pages: int, seed: int = 0) -> bytes:
+    """
+    Builds a PDF whose formatting only survives in the layout: every page has
+    a bold title, paragraphs, a section heading, a bullet list with wrapped
+    items and a two column section.
+    """
+    streams = []
+    for page_number in range(pages):
+        rng = random.Random(seed * 100_003 + page_number)
+        content = []
+        y = 760
+
+        def line(text: str, x: float, font: str = "F1", size: float = 10):
+            content.append(f"BT /{font} {size} Tf {x} {y} Td ({_escape(text)}) Tj ET")
+
+        line(f"Chapter {page_number + 1} Quarterly report", 50, "F2", 18)
+        y -= 34
+        for _ in range(2):
+            for text in _wrap(rng, rng.randint(30, 50), 95):
+                line(text, 50)
+                y -= 12
+            y -= 8
+        y -= 6
+        line(f"Section {page_number + 1}.1 Delivery terms", 50, "F2", 13)
+        y -= 22
+        for _ in range(3):
+            for number, text in enumerate(_wrap(rng, rng.randint(10, 24), 85)):
+                line(f"- {text}" if number == 0 else text, 50 if number == 0 else 60)
+                y -= 12
+        y -= 14
+
+        top = y
+        for x in (50, 320):
+            y = top
+            for _ in range(2):
+                for text in _wrap(rng, rng.randint(25, 40), 45):
+                    line(text, x)
+                    y -= 12
+                y -= 8
+        streams.append("\n".join(content))
+    return _write_pdf(streams)
+
+
+def _write_pdf(streams: list) -> bytes:
+    # one page per content stream, Helvetica as /F1 and Helvetica-Bold as /F2
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")
+    pages_obj = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    bold_font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold >>")
+
+    page_ids = []
+    for content in streams:
+        stream = content.encode("latin-1")
+        content_id = add(
+            b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        )
+        page_ids.append(
+            add(
+                b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+                b"/Resources << /Font << /F1 %d 0 R /F2 %d 0 R >> >> /Contents %d 0 R >>"
+                % (pages_obj, font, bold_font, content_id)
+            )
+        )
+    pages = len(page_ids)
+
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj
+    objects[pages_obj - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        catalog,
+        xref,
+    )
+    return bytes(out)
@@ -0,0 +1,176 @@
+"""
+Offline benchmark of the backend with fake OpenAI clients.
+
+    python -m bench.run --pages 1 10 100 500 --llm-latency 0.2 --json out.json
+    python -m bench.run --baseline out.json   # exits 1 on a regression
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Everything the backend persists goes to a throwaway folder, so every run is cold
+os.environ.setdefault("PERSONALAI_CACHE_DIR", tempfile.mkdtemp(prefix="personalai-bench-"))
+
+from backend.backend import (add_pdf_to_corpus, get_parsed_translated_text, get_pdf_text,
+                             get_pdf_text_splitter, get_rag_chain, get_vectorstore_from_pdf,
+                             new_corpus)
+from backend.context import assemble_context
+from backend.lexical import get_retriever
+from bench.fakes import install_fakes
+from bench.pdfgen import make_pdf
+
+QUERIES = [
+    "What does the warranty clause say about delivery?",
+    "payment invoice within days",
+    "Part number PN-00003",
+    "quarterly revenue growth and market risk",
+]
+
+
+def measure(name: str, pages: int, func, trace_memory: bool, items: int = None, unit: str = "pages"):
+    # throughput is reported in `unit`s per second, pages unless told otherwise
+    items = pages if items is None else items
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    row = {
+        "stage": name,
+        "pages": pages,
+        "seconds": round(seconds, 4),
+        "throughput": round(items / seconds, 2) if seconds else None,
+        "unit": unit,
+        "peak_python_mb": round(peak / 2**20, 2) if peak is not None else None,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    print(
+        f"{name:<14}{pages:>6} pages {row['seconds']:>10.3f}s "
+        f"{row['throughput'] or 0:>10.1f} {unit}/s"
+        + (f" {row['peak_python_mb']:>8.1f} MB peak" if peak is not None else "")
+    )
+    return row, result
+
+
+def run_document(pages: int, args) -> list:
+    # a different seed per size keeps the embedding cache cold
+    data = make_pdf(pages, seed=pages)
+    trace = args.memory
+    rows = []
+
+    row, text = measure("pdf_text", pages, lambda: get_pdf_text(io.BytesIO(data)), trace)
+    rows.append(row)
+
+    row, chunks = measure("split", pages, lambda: get_pdf_text_splitter().split_text(text), trace)
+    rows.append(row)
+
+    row, vector_store = measure("vectorstore", pages, lambda: get_vectorstore_from_pdf(text), trace)
+    rows.append(row)
+
+    queries = [QUERIES[i % len(QUERIES)] for i in range(args.queries)]
+
+    def retrieve():
+        for query in queries:
+            vector_store.similarity_search(query, k=4)
+
+    row, _ = measure("retrieval", pages, retrieve, trace, len(queries), "queries")
+    rows.append(row)
+
+    # the chatbot's path: a corpus, hybrid retrieval and the RAG chain
+    corpus = new_corpus()
+
+    def index_corpus():
+        add_pdf_to_corpus(corpus, io.BytesIO(data), "bench", {"source": "bench.pdf"})
+        add_pdf_to_corpus(corpus, io.BytesIO(make_pdf(1, seed=-pages)), "other", {"source": "other.pdf"})
+
+    row, _ = measure("corpus", pages, index_corpus, trace)
+    rows.append(row)
+
+    def retrieve_hybrid():
+        retriever = get_retriever(corpus.vector_store, filter={"doc_id": ["bench"]})
+        for query in queries:
+            assemble_context(retriever.invoke(query))
+
+    row, _ = measure("hybrid", pages, retrieve_hybrid, trace, len(queries), "queries")
+    rows.append(row)
+
+    # numbered so neither the LLM cache nor the answer cache serves a repeat
+    rag_queries = [f"{QUERIES[i % len(QUERIES)]} ({i})" for i in range(args.rag_queries)]
+
+    def answer():
+        chain = get_rag_chain(corpus.vector_store)
+        for query in rag_queries:
+            chain.invoke({"chat_history": [], "input": query})
+
+    row, _ = measure("rag", pages, answer, trace, len(rag_queries), "queries")
+    rows.append(row)
+
+    if pages <= args.translate_max_pages:
+        row, _ = measure(
+            "translation", pages, lambda: get_parsed_translated_text(io.BytesIO(data)), trace
+        )
+        rows.append(row)
+    return rows
+
+
+def compare(rows: list, baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path) as f:
+        baseline = {(row["stage"], row["pages"]): row for row in json.load(f)["results"]}
+
+    ok = True
+    for row in rows:
+        before = baseline.get((row["stage"], row["pages"]))
+        if before is None:
+            continue
+        if row["seconds"] > before["seconds"] * (1 + tolerance):
+            print(
+                f"REGRESSION {row['stage']} @ {row['pages']} pages: "
+                f"{before['seconds']:.3f}s -> {row['seconds']:.3f}s"
+            )
+            ok = False
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100, 500])
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per generated word")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="seconds per embedding request")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--rag-queries", type=int, default=5, help="questions answered through the RAG chain")
+    parser.add_argument("--translate-max-pages", type=int, default=100)
+    parser.add_argument("--memory", action="store_true", help="trace Python allocations (slower)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown vs the baseline")
+    args = parser.parse_args(argv)
+
+    install_fakes(args.llm_latency, args.token_latency, args.embedding_latency)
+
+    rows = []
+    for pages in args.pages:
+        rows.extend(run_document(pages, args))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+
+    if args.baseline and not compare(rows, args.baseline, args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
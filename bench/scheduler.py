@@ -0,0 +1,85 @@
+"""
+Embeds generated chunks through EmbeddingScheduler against the throttling
+fake endpoint and reports throughput and the number of 429s absorbed.
+
+    python -m bench.scheduler --chunks 2000 --rpm 120 --tpm 200000 --window 5
+"""
+import argparse
+import time
+
+import openai
+from langchain_core.embeddings import Embeddings
+
+from backend.scheduler import EmbeddingScheduler
+from bench.fake_openai_server import start_server
+from bench.pdfgen import make_text_lines
+
+
+class RawOpenAIEmbeddings(Embeddings):
+    """
+    Calls the embeddings endpoint with the OpenAI SDK directly. Unlike
+    OpenAIEmbeddings it does not need the tiktoken files, which are not
+    available offline.
+    """
+
+    def __init__(self, base_url: str, model: str = "text-embedding-ada-002"):
+        self.model = model
+        self.client = openai.OpenAI(api_key="fake", base_url=base_url, max_retries=0)
+        self.async_client = openai.AsyncOpenAI(api_key="fake", base_url=base_url, max_retries=0)
+
+    def embed_documents(self, texts: list) -> list:
+        response = self.client.embeddings.create(input=texts, model=self.model)
+        return [item.embedding for item in response.data]
+
+    async def aembed_documents(self, texts: list) -> list:
+        response = await self.async_client.embeddings.create(input=texts, model=self.model)
+        return [item.embedding for item in response.data]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--rpm", type=int, default=120, help="server side request budget per window")
+    parser.add_argument("--tpm", type=int, default=200_000, help="server side token budget per window")
+    parser.add_argument("--window", type=float, default=60.0, help="server budget window in seconds")
+    parser.add_argument("--client-rpm", type=int, default=None, help="scheduler budget, defaults to the server's")
+    parser.add_argument("--client-tpm", type=int, default=None)
+    parser.add_argument("--batch-tokens", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    server, throttle = start_server(
+        requests_per_minute=args.rpm, tokens_per_minute=args.tpm, window=args.window
+    )
+    embeddings = RawOpenAIEmbeddings(f"http://127.0.0.1:{server.server_port}/v1")
+
+    # the scheduler budgets are per minute, the server's per window
+    scale = 60.0 / args.window
+    scheduler = EmbeddingScheduler(
+        embeddings,
+        max_batch_tokens=args.batch_tokens,
+        concurrency=args.concurrency,
+        requests_per_minute=int((args.client_rpm or args.rpm) * scale),
+        tokens_per_minute=int((args.client_tpm or args.tpm) * scale),
+        base_delay=0.2,
+    )
+
+    texts = [" ".join(make_text_lines(i, 12)) for i in range(args.chunks)]
+    start = time.perf_counter()
+    vectors = scheduler.embed_documents(texts)
+    seconds = time.perf_counter() - start
+
+    assert len(vectors) == len(texts) and all(vectors)
+    print(
+        f"{len(texts)} chunks in {len(scheduler.make_batches(texts))} batches, {seconds:.2f}s "
+        f"({len(texts) / seconds:.0f} chunks/s), server accepted {throttle.accepted} "
+        f"rejected {throttle.rejected}, scheduler retried {scheduler.rate_limited}"
+    )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,22 @@
 import os
+import time
 
 import streamlit as st
-from langchain_core.messages import AIMessage, HumanMessage
-from pyperclip import copy
 
-from backend.backend import (get_parsed_translated_text, get_response, get_vectorstore_from_pdf,
-                             get_vectorstore_from_url, get_pdf_text)
+from backend.lazy import lazy_module
+from backend.session_store import SessionDocuments, get_session_store
+from backend.tracing import is_enabled, jsonl_text, prometheus_text, recent_spans, record_span
+
+# LangChain, FAISS, pdfplumber and the OpenAI client are only imported by the
+# mode that needs them, on first use
+rag = lazy_module("backend.backend")
+translation_jobs = lazy_module("backend.jobs")
+
+# Time of the whole script run, reported as a "streamlit_rerun" stage
+run_started = time.perf_counter()
+
+# Set to the running translation job the page streams until it stops
+running_job = None
 
 ## Handle secret contents
 os.environ["OPENAI_API_KEY"] = st.secrets["openai"]["OPENAI_API_KEY"]
@@ -20,7 +31,6 @@ lang_pair = {
         "upload_file": "Upload an article",
         "original_file": "Original File",
         "translation": "Translation",
-        "page_limit_warning": "At the moment of dev, page is limited to less than 3 pages, Try Again!",
         "spinner": "Loading.....",
         "sidebar_radio": "Choose AI function",
         "copy_to_clipboard": "Copy to Clipboard",
@@ -32,7 +42,6 @@ lang_pair = {
         "upload_file": "원하시는 파일을 선택해주세요",
         "original_file": "업로드 파일",
         "translation": "🇺🇸 -> 🇰🇷",
-        "page_limit_warning": "개발단계 최대 업로드 페이지는 최대 3 페이지 입니다. 다른 파일을 선택해주세요",
         "spinner": "⏳ 처리중...",
         "sidebar_radio": "원하시는 기능을 선택해주세요",
         "copy_to_clipboard": "클립보드에 복사",
@@ -71,11 +80,17 @@ if authenticated:
     # Main Header
     st.title(label["greeting"])
 
+    # Texts and corpora of this session, spilled to disk past the memory budgets
+    if "documents" not in st.session_state:
+        st.session_state.documents = SessionDocuments(get_session_store())
+    documents = st.session_state.documents
+
     # Sidebar
     with st.sidebar:
         mode = st.radio(label["sidebar_radio"], ("Translation", "Chatbot"))
 
     if mode == "Translation":
+        translation_jobs.preload()
         if "uploaded_file" not in st.session_state:
             st.session_state.uploaded_file = None
 
@@ -92,37 +107,73 @@ if authenticated:
                 }
 
         if st.session_state.uploaded_file:
-            session_obj = st.session_state[st.session_state.uploaded_file.file_id]
-            try:
-
-                if not session_obj["parsed"]:
-                    with st.spinner(label["spinner"]):
-                        parsed, translated = get_parsed_translated_text(
-                            st.session_state.uploaded_file
-                        )
-                        session_obj["parsed_text"] = parsed
-                        session_obj["translated_text"] = translated
-                        session_obj["parsed"] = True
-
-                # Render parsed_text from pdf file
-                with st.expander(
-                    label["original_file"] + f": {st.session_state.uploaded_file.name}"
-                ):
-                    st.markdown(session_obj["parsed_text"])
-                st.divider()
-
-                # Render the translation outcome
-                with st.expander(label["translation"]):
-                    st.markdown(session_obj["translated_text"])
-
-            except ValueError:
-                uploaded_file = None
-                st.warning(label["page_limit_warning"])
+            file_id = st.session_state.uploaded_file.file_id
+            session_obj = st.session_state[file_id]
+
+            # Translation runs as a background job: reruns and disconnects don't stop it
+            jobs = translation_jobs.get_translation_jobs()
+            if "job_id" not in session_obj:
+                session_obj["job_id"] = jobs.submit(
+                    st.session_state.uploaded_file, st.session_state.uploaded_file.name
+                )
+
+            texts = documents.get(file_id) if session_obj["parsed"] else None
+            if session_obj["parsed"] and texts is None:
+                # spilled copy expired, the finished job may still have the result
+                texts = jobs.result(session_obj["job_id"])
+                if texts is None:
+                    # job folder expired too, translate again
+                    session_obj["parsed"] = False
+                    jobs.submit(st.session_state.uploaded_file, st.session_state.uploaded_file.name)
+                else:
+                    documents[file_id] = texts
+
+            if session_obj["parsed"]:
+                parsed_text, translated_text = texts
+            else:
+                job = jobs.poll(session_obj["job_id"])
+                if job["status"] in ("interrupted", "unknown"):
+                    # resumes from the last checkpointed segment, or restarts an expired job
+                    jobs.submit(st.session_state.uploaded_file, st.session_state.uploaded_file.name)
+                    job = jobs.poll(session_obj["job_id"])
+
+                texts = jobs.result(session_obj["job_id"]) if job["status"] == "done" else None
+                if texts is not None:
+                    parsed_text, translated_text = texts
+                    documents[file_id] = texts
+                    session_obj["parsed"] = True
+                else:
+                    # segments finished so far, in document order
+                    finished = jobs.partial(session_obj["job_id"])
+                    parsed_text = "\n\n".join(parsed for parsed, _ in finished)
+                    translated_text = "\n\n".join(translated for _, translated in finished)
+
+                    if job["status"] == "failed":
+                        st.error(job["error"])
+                    else:
+                        progress = job["done"] / job["total"] if job["total"] else 0.0
+                        running_job = (session_obj["job_id"], st.progress(progress, text=label["spinner"]))
+
+            # Render parsed_text from pdf file
+            with st.expander(
+                label["original_file"] + f": {st.session_state.uploaded_file.name}",
+                expanded=not session_obj["parsed"],
+            ):
+                parsed_area = st.empty()
+                parsed_area.markdown(parsed_text)
+            st.divider()
+
+            # Render the translation outcome
+            with st.expander(label["translation"], expanded=not session_obj["parsed"]):
+                translated_area = st.empty()
+                translated_area.markdown(translated_text)
 
     elif mode == "Chatbot":
+        rag.preload()
+        from langchain_core.messages import AIMessage, HumanMessage
 
-        uploaded_pdf_file = st.file_uploader("webites URL")
-        if uploaded_pdf_file is None:
+        uploaded_pdf_files = st.file_uploader("webites URL", type="pdf", accept_multiple_files=True)
+        if not uploaded_pdf_files:
             st.info("Please select a file")
 
         else:
@@ -132,19 +183,41 @@ if authenticated:
                     AIMessage(content="Hello, I'm a bot, How can I help you")
                 )
 
-            if "vector_stores" not in st.session_state:
-                text = get_pdf_text(uploaded_pdf_file)
-                st.session_state.vector_store = get_vectorstore_from_pdf(text)
+            # Index only the files added since the last run, drop the removed ones
+            corpus = documents.checkout("corpus")
+            corpus = rag.new_corpus() if corpus is None else rag.restore_corpus(corpus)
+
+            uploaded_ids = {file.file_id: file for file in uploaded_pdf_files}
+            for doc_id in list(corpus.documents):
+                if doc_id not in uploaded_ids:
+                    corpus.remove_document(doc_id)
+            for doc_id, file in uploaded_ids.items():
+                rag.add_pdf_to_corpus(corpus, file, doc_id, {"source": file.name})
+            # put back so the store measures the documents added
+            documents["corpus"] = corpus
+
+            # scanned PDFs without a text layer have nothing to search
+            unreadable = [
+                uploaded_ids[doc_id].name
+                for doc_id, document in corpus.documents.items()
+                if not document["chunk_ids"]
+            ]
+            if unreadable:
+                st.warning("No text could be read from: " + ", ".join(unreadable))
+
+            # Search every document unless some are picked
+            selected_ids = st.multiselect(
+                "Documents",
+                list(uploaded_ids),
+                format_func=lambda doc_id: uploaded_ids[doc_id].name,
+            )
 
             ##### user input
-            user_query = st.chat_input("Type your message here... ")
+            user_query = st.chat_input(
+                "Type your message here... ", disabled=corpus.vector_store is None
+            )
             ## When st.chat_input is used in the main body of an app, it will be pinned to the bottom of the page.
 
-            if user_query is not None and user_query != "":
-                respose = get_response(user_query)
-                st.session_state.chat_history.append(HumanMessage(content=user_query))
-                st.session_state.chat_history.append(AIMessage(content=respose))
-
             ##### conversation
             for message in st.session_state.chat_history:
                 if isinstance(message, AIMessage):
@@ -154,3 +227,43 @@ if authenticated:
                 elif isinstance(message, HumanMessage):
                     with st.chat_message("Human"):
                         st.write(message.content)
+
+            if user_query is not None and user_query != "":
+                with st.chat_message("Human"):
+                    st.write(user_query)
+
+                # Stream the answer tokens as the model produces them
+                with st.chat_message("AI"):
+                    respose = st.write_stream(rag.stream_response(user_query, corpus.vector_store, selected_ids))
+
+                st.session_state.chat_history.append(HumanMessage(content=user_query))
+                st.session_state.chat_history.append(AIMessage(content=respose))
+
+    # Debug panel, only with tracing enabled (PERSONALAI_TRACE=1)
+    if is_enabled():
+        record_span("streamlit_rerun", time.perf_counter() - run_started)
+        with st.sidebar.expander("Debug: backend stages"):
+            st.dataframe(list(reversed(recent_spans(50))))
+            st.download_button("trace.jsonl", jsonl_text(), file_name="trace.jsonl")
+            st.code(prometheus_text())
+
+    # Stream the running translation job into the page, refresh once it stops
+    if running_job is not None:
+        job_id, progress_bar = running_job
+        jobs = translation_jobs.get_translation_jobs()
+        shown = None
+        while True:
+            # polling a running job reads no files, the page is only redrawn on changes
+            job = jobs.poll(job_id)
+            if job["status"] != "running":
+                break
+            revision = jobs.revision(job_id)
+            if revision is not None and revision != shown:
+                shown = revision
+                finished = jobs.partial(job_id)
+                parsed_area.markdown("\n\n".join(parsed for parsed, _ in finished))
+                translated_area.markdown("\n\n".join(translated for _, translated in finished))
+                progress = job["done"] / job["total"] if job["total"] else 0.0
+                progress_bar.progress(progress, text=label["spinner"])
+            time.sleep(0.2)
+        st.rerun()